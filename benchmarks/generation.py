@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from gpsr_commands import CommandGenerator
+from egpsr_commands import EgpsrCommandGenerator
+from world_model import read_data, parse_names, parse_locations, parse_rooms, parse_objects, load_world_model
+
+PERCENTILES = [50, 90, 99]
+
+
+def word(i):
+    # Letters only, the names and locations tables do not accept digits
+    letters = ""
+    while True:
+        letters = chr(ord("a") + i % 26) + letters
+        i = i // 26 - 1
+        if i < 0:
+            return letters
+
+
+def write_world(directory, size):
+    # Synthetic world files in the markdown format of the competition template with size entries per table
+    paths = {name: os.path.join(directory, name + ".md") for name in ["names", "locations", "rooms", "objects"]}
+    with open(paths["names"], "w") as file:
+        file.write("# Names\n\n| Names |\n| :---: |\n")
+        file.writelines("| Name%s |\n" % word(i) for i in range(size))
+    with open(paths["locations"], "w") as file:
+        file.write("# Location names\n\n| Location ID | Name |\n| :---: | :---: |\n")
+        file.writelines("| %d | location %s%s |\n" % (i + 1, word(i), " (p)" if i % 2 == 0 else "")
+                        for i in range(size))
+    with open(paths["rooms"], "w") as file:
+        file.write("# Room names\n\n| Room names |\n| :---: |\n")
+        file.writelines("| room %s |\n" % word(i) for i in range(size))
+    with open(paths["objects"], "w") as file:
+        categories = max(2, size // 10)
+        for c in range(categories):
+            file.write("# Class Things_%s (thing_%s)\n\n| Objectname |\n| :---: |\n" % (word(c), word(c)))
+            file.writelines("| object_%s |\n" % word(i) for i in range(c, size, categories))
+            file.write("\n")
+    return paths
+
+
+def parse_world(paths):
+    location_names, placement_location_names = parse_locations(read_data(paths["locations"]))
+    object_names, object_categories_plural, object_categories_singular = parse_objects(read_data(paths["objects"]))
+    return (parse_names(read_data(paths["names"])), location_names, placement_location_names,
+            parse_rooms(read_data(paths["rooms"])), object_names, object_categories_plural, object_categories_singular)
+
+
+def load_world(paths, cache_path=None, cold=False):
+    if cold and os.path.exists(cache_path):
+        # Parsed again and written to the cache, like the first run after the world files changed
+        os.remove(cache_path)
+    return load_world_model(paths["names"], paths["locations"], paths["rooms"], paths["objects"], cache_path=cache_path)
+
+
+def scenarios(paths, seed):
+    generator = CommandGenerator(*parse_world(paths), rng=random.Random(seed))
+    egpsr_generator = EgpsrCommandGenerator(generator)
+    cache_path = os.path.join(os.path.dirname(paths["names"]), "world_model.cache")
+    cases = {
+        "parse_world": lambda: parse_world(paths),
+        "load_world:uncached": lambda: load_world(paths),
+        "load_world:cold_cache": lambda: load_world(paths, cache_path, cold=True),
+        "load_world:warm_cache": lambda: load_world(paths, cache_path)
+    }
+    for category in ["", "people", "objects"]:
+        cases["command_start:" + (category or "any")] = \
+            lambda category=category: generator.generate_command_start(cmd_category=category)
+    for followup in generator.followup_cmd_lists:
+        cases["command_followup:" + followup] = \
+            lambda followup=followup: generator.generate_command_followup(followup)
+    cases["egpsr_setup"] = egpsr_generator.generate_setup
+    return cases
+
+
+def measure(function, iterations, memory_iterations):
+    latencies = []
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        start = clock()
+        function()
+        latencies.append(clock() - start)
+    latencies.sort()
+    total = sum(latencies) / 1e9
+    # Peak memory is measured in a separate run since tracing slows every allocation down
+    results = []
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        results.append(function())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "total_s": total,
+        "ops_per_s": iterations / total if total else None,
+        "latency_us": {"p%d" % p: latencies[min(len(latencies) - 1, len(latencies) * p // 100)] / 1e3
+                       for p in PERCENTILES},
+        "peak_memory_bytes": peak,
+        "peak_memory_iterations": memory_iterations
+    }
+
+
+def run(sizes, iterations, parse_iterations, memory_iterations, seed):
+    results = {"python": platform.python_version(), "platform": platform.platform(), "seed": seed, "sizes": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            world_directory = os.path.join(directory, str(size))
+            os.mkdir(world_directory)
+            cases = scenarios(write_world(world_directory, size), seed)
+            results["sizes"][str(size)] = {}
+            for name, function in cases.items():
+                count = parse_iterations if name == "parse_world" or name.startswith("load_world") else iterations
+                results["sizes"][str(size)][name] = measure(function, count, min(memory_iterations, count))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark command generation, EGPSR setups and world parsing")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="entries per synthetic names, locations, rooms and objects table")
+    parser.add_argument("--iterations", type=int, default=10000, help="timed calls per generation benchmark")
+    parser.add_argument("--parse-iterations", type=int, default=20,
+                        help="timed calls of the world parsers and of world model loading")
+    parser.add_argument("--memory-iterations", type=int, default=1000,
+                        help="calls whose results are kept while tracing peak memory")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generators")
+    parser.add_argument("--output", default="-", help="JSON file for the results, '-' for stdout")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.iterations, args.parse_iterations, args.memory_iterations, args.seed)
+    if args.output == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,38 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Headless generation against loading the imaging libraries up front as generator.py used to
+SCENARIOS = {
+    "headless": "import generator",
+    "with_qr_codes": "import generator, qr_codes",
+}
+
+
+def time_import(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", statement], cwd=REPO_DIR, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        timings.append(elapsed)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "max_s": max(timings)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure interpreter start up with and without imaging libraries")
+    parser.add_argument("--repeat", type=int, default=20, help="number of interpreter starts per scenario")
+    args = parser.parse_args()
+
+    results = {name: time_import(statement, args.repeat) for name, statement in SCENARIOS.items()}
+    if "median_s" in results["headless"] and "median_s" in results["with_qr_codes"]:
+        results["import_saving_s"] = results["with_qr_codes"]["median_s"] - results["headless"]["median_s"]
+    print(json.dumps(results, indent=2))
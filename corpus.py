@@ -0,0 +1,180 @@
+import array
+import itertools
+import json
+import mmap
+import struct
+import sys
+from gpsr_commands import CommandGenerator, Command, CHOICE, ARTICLE
+
+# File layout: header, JSON metadata padded to 8 bytes, then count rows of width integers of one type.
+# A row holds the category, the command chain padded with -1 and the decisions of the command padded with 0
+MAGIC = b"GPSRCORP"
+VERSION = 1
+HEADER = struct.Struct("<8sIIcxxxIQ")
+CATEGORIES = ["people", "objects"]
+WORLD_FIELDS = ["person_names", "location_names", "placement_location_names", "room_names", "object_names",
+                "object_categories_plural", "object_categories_singular"]
+
+
+def max_decisions(tokens):
+    count = 0
+    for token in tokens:
+        if token.__class__ is str or token[0] == ARTICLE:
+            continue
+        if token[0] == CHOICE:
+            count += 1 + max(max_decisions(alternative) for alternative in token[1])
+        else:
+            count += 1
+    return count
+
+
+def iter_chains(generator, command):
+    followup = generator.compiled_templates[command][1]
+    if followup is None:
+        yield (command,)
+        return
+    for next_command in dict.fromkeys(itertools.chain(*generator.followup_cmd_lists[followup].values())):
+        for chain in iter_chains(generator, next_command):
+            yield (command,) + chain
+
+
+class CorpusLayout:
+
+    def __init__(self, commands, chain_width, decisions_width, typecode):
+        self.commands = commands
+        self.command_ids = {command: i for i, command in enumerate(commands)}
+        self.chain_width = chain_width
+        self.decisions_width = decisions_width
+        self.width = 1 + chain_width + decisions_width
+        self.typecode = typecode
+
+    @classmethod
+    def from_generator(cls, generator):
+        # Wide enough for every chain of every start command, whatever the weights and categories
+        chains = [chain for command in dict.fromkeys(itertools.chain(*generator.start_cmd_lists.values()))
+                  for chain in iter_chains(generator, command)]
+        decisions_width = max(max_decisions(generator.chain_template(chain)) for chain in chains)
+        largest = max([len(generator.command_templates)] + [len(vocab) for vocab in generator.placeholder_dict.values()])
+        return cls(sorted(generator.command_templates), max(len(chain) for chain in chains), decisions_width,
+                   "h" if largest < 2 ** 15 else "i")
+
+    def metadata(self, generator):
+        return {"commands": self.commands, "chain_width": self.chain_width, "decisions_width": self.decisions_width,
+                "byteorder": sys.byteorder, "world": {field: getattr(generator, field) for field in WORLD_FIELDS}}
+
+
+def encode_commands(generator, commands, layout=None):
+    layout = layout or CorpusLayout.from_generator(generator)
+    rows = array.array(layout.typecode)
+    chain_padding = [-1] * layout.chain_width
+    decisions_padding = [0] * layout.decisions_width
+    for command in commands:
+        rows.append(CATEGORIES.index(command.category))
+        chain = [layout.command_ids[name] for name in command.chain]
+        rows.extend(chain + chain_padding[len(chain):])
+        rows.extend(command.decisions + tuple(decisions_padding[len(command.decisions):]))
+    return rows.tobytes()
+
+
+class CorpusWriter:
+
+    def __init__(self, file_path, generator):
+        self.generator = generator
+        self.layout = CorpusLayout.from_generator(generator)
+        self.count = 0
+        metadata = json.dumps(self.layout.metadata(generator)).encode()
+        metadata += b" " * (-(HEADER.size + len(metadata)) % 8)
+        self.metadata_size = len(metadata)
+        self.file = open(file_path, "wb")
+        self.write_header()
+        self.file.write(metadata)
+
+    def write_header(self):
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.layout.width, self.layout.typecode.encode(),
+                                    self.metadata_size, self.count))
+
+    def write(self, commands):
+        self.write_rows(encode_commands(self.generator, commands, self.layout))
+
+    def write_rows(self, rows):
+        # Blocks encoded by encode_commands, for instance in the workers of iter_parallel
+        self.file.write(rows)
+        self.count += len(rows) // (self.layout.width * array.array(self.layout.typecode).itemsize)
+
+    def close(self):
+        # The number of rows is only known at the end, it is written into the header last
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Random access to a memory mapped corpus, commands are only decoded and rendered when indexed
+class CorpusReader:
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, typecode, metadata_size, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(file_path + " is not a command corpus of version %d" % VERSION)
+        self.typecode = typecode.decode()
+        self.metadata = json.loads(bytes(self.map[HEADER.size:HEADER.size + metadata_size]))
+        if self.metadata["byteorder"] != sys.byteorder:
+            raise ValueError(file_path + " was written on a machine of a different byte order")
+        self.layout = CorpusLayout(self.metadata["commands"], self.metadata["chain_width"],
+                                   self.metadata["decisions_width"], self.typecode)
+        offset = HEADER.size + metadata_size
+        itemsize = array.array(self.typecode).itemsize
+        # Flat view of all rows, slicing it never copies
+        self.rows = memoryview(self.map)[offset:offset + self.count * self.width * itemsize].cast(self.typecode)
+        self.generator = None
+
+    def __len__(self):
+        return self.count
+
+    def row(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError("corpus index out of range")
+        i %= self.count
+        return self.rows[i * self.width:(i + 1) * self.width]
+
+    def slice(self, start, stop):
+        # Rows start to stop as one flat view of width integers per row
+        start, stop, _ = slice(start, stop).indices(self.count)
+        return self.rows[start * self.width:max(start, stop) * self.width]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        row = self.row(i)
+        if self.generator is None:
+            # Built from the vocabulary stored in the file, the world files are not needed to read a corpus
+            self.generator = CommandGenerator(*[self.metadata["world"][field] for field in WORLD_FIELDS])
+        chain_width = self.layout.chain_width
+        chain = tuple(self.layout.commands[c] for c in row[1:1 + chain_width] if c >= 0)
+        return Command(self.generator, CATEGORIES[row[0]], chain, self.generator.chain_template(chain),
+                       tuple(row[1 + chain_width:]))
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def close(self):
+        # Views from row and slice may outlive the reader, the map is then unmapped once the last of them is freed
+        self.file.close()
+        try:
+            self.rows.release()
+            self.map.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,14 +1,39 @@
-import random
-import re
 import itertools
+import random
 import warnings
 from gpsr_commands import CommandGenerator
 
 
 class EgpsrCommandGenerator:
 
-    def __init__(self, gpsr_generator):
+    def __init__(self, gpsr_generator, rng=None):
         self.gpsr_generator = gpsr_generator
+        # Shares the random stream of the GPSR generator unless given its own
+        self.rng = gpsr_generator.rng if rng is None else rng
+        self.compile_templates()
+
+    misplaced_objects_template = "1. The {obj} is at the {plcmtLoc} instead of at the {plcmtLoc2}" \
+                                 "\n2. Put an object on the floor {inRoom}"
+    person_request_templates = ["3. There is a person at the {loc}, their request is:\n\t",
+                                "\n4. There is a person at the {loc2}, their request is:\n\t"]
+
+    def compile_templates(self):
+        # Called again after the world model of the GPSR generator is updated
+        misplaced_objects_tokens = self.gpsr_generator.compile_template(self.misplaced_objects_template)
+        person_request_tokens = [self.gpsr_generator.compile_template(template)
+                                 for template in self.person_request_templates]
+        self.misplaced_objects_tokens, self.person_request_tokens = misplaced_objects_tokens, person_request_tokens
+
+    def enable_profiling(self, profile=None):
+        # Profiles the setup steps and the GPSR generator they draw from together
+        profile = self.gpsr_generator.enable_profiling(profile)
+        profile.attach_egpsr(self)
+        return profile
+
+    def disable_profiling(self):
+        if self.gpsr_generator.profile is not None:
+            self.gpsr_generator.profile.detach(self)
+        self.gpsr_generator.disable_profiling()
 
     def generate_setup(self):
         setup_string = ""
@@ -17,22 +42,50 @@ class EgpsrCommandGenerator:
         return setup_string
 
     def generate_misplaced_objects(self):
-        misplaced_objects_string = "1. The {obj} is at the {plcmtLoc} instead of at the {plcmtLoc2}" \
-                                    "\n2. Put an object on the floor {inRoom}"
-        for ph in re.findall(r'(\{\w+\})', misplaced_objects_string, re.DOTALL):
-            misplaced_objects_string = misplaced_objects_string.replace(ph, self.gpsr_generator.insert_placeholders(ph))
-        misplaced_objects_string = misplaced_objects_string.replace("plcmtLoc2", random.choice(
-                [x for x in self.gpsr_generator.placement_location_names if x not in misplaced_objects_string]))
-        return misplaced_objects_string
+        return self.gpsr_generator.render_template(self.misplaced_objects_tokens, self.rng)
 
     def generator_person_requests(self):
-        person_requests_string = "3. There is a person at the {loc}, their request is:" \
-                                    "\n\t" + self.gpsr_generator.generate_command_start(cmd_category="people") + \
-                                    "\n4. There is a person at the {loc2}, their request is:" \
-                                    "\n\t" + self.gpsr_generator.generate_command_start(cmd_category="objects")
-        for ph in re.findall(r'(\{\w+\})', person_requests_string, re.DOTALL):
-            person_requests_string = person_requests_string.replace(ph, self.gpsr_generator.insert_placeholders(ph))
-        person_requests_string = person_requests_string.replace("loc2", random.choice(
-                [x for x in self.gpsr_generator.location_names if x not in person_requests_string]))
-
-        return person_requests_string
\ No newline at end of file
+        people_request = self.gpsr_generator.generate_record("people", self.rng)
+        objects_request = self.gpsr_generator.generate_record("objects", self.rng)
+        # The second person is not put at a location that is already part of the setup
+        bound = [(self.gpsr_generator.entity_kind(ph), value)
+                 for ph, value in people_request["bindings"] + objects_request["bindings"]]
+        tokens = self.person_request_tokens[0] + [people_request["text"]] + \
+            self.person_request_tokens[1] + [objects_request["text"]]
+        return self.gpsr_generator.render_template(tokens, self.rng, bound)
+
+    def generate_setups(self, n, seed=None):
+        return list(self.iter_setups(n, seed))
+
+    def iter_setups(self, n=None, seed=None):
+        rng = self.rng if seed is None else random.Random(seed)
+        for _ in (itertools.count() if n is None else range(n)):
+            yield self.generate_setup_record(rng)
+
+    def generate_setup_record(self, rng=None):
+        # Draws exactly like generate_setup, but also returns what was placed where
+        if rng is None:
+            rng = self.rng
+        gpsr_generator = self.gpsr_generator
+        misplaced_bindings = []
+        misplaced_text = gpsr_generator.replay_templates(
+            [self.misplaced_objects_tokens], gpsr_generator.derive_template(self.misplaced_objects_tokens, rng),
+            misplaced_bindings)
+        requests = [gpsr_generator.generate_record("people", rng), gpsr_generator.generate_record("objects", rng)]
+        bound = [(gpsr_generator.entity_kind(ph), value)
+                 for request in requests for ph, value in request["bindings"]]
+        tokens = self.person_request_tokens[0] + [requests[0]["text"]] + \
+            self.person_request_tokens[1] + [requests[1]["text"]]
+        person_bindings = []
+        person_text = gpsr_generator.replay_templates([tokens], gpsr_generator.derive_template(tokens, rng, bound),
+                                                      person_bindings)
+        misplaced = dict(misplaced_bindings)
+        persons = dict(person_bindings)
+        return {
+            "misplaced_object": {"object": misplaced["obj"], "location": misplaced["plcmtLoc"],
+                                 "expected_location": misplaced["plcmtLoc2"]},
+            "floor_object_room": misplaced["room"],
+            "persons": [{"location": persons["loc"], "request": requests[0]},
+                        {"location": persons["loc2"], "request": requests[1]}],
+            "text": misplaced_text + "\n" + person_text
+        }
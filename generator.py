@@ -1,100 +1,162 @@
+import argparse
+import csv
+import itertools
+import json
 import random
 import re
-import warnings
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
+import sys
 from gpsr_commands import CommandGenerator
 from egpsr_commands import EgpsrCommandGenerator
-
-
-def read_data(file_path):
-    with open(file_path, 'r') as file:
-        data = file.read()
-    return data
-
-
-def parse_names(data):
-    parsed_names = re.findall(r'\|\s*([A-Za-z]+)\s*\|', data, re.DOTALL)
-    parsed_names = [name.strip() for name in parsed_names]
-
-    if parsed_names:
-        return parsed_names[1:]
-    else:
-        warnings.warn("List of names is empty. Check content of names markdown file")
-        return []
-
-
-def parse_locations(data):
-    parsed_locations = re.findall(r'\|\s*([0-9]+)\s*\|\s*([A-Za-z,\s, \(,\)]+)\|', data, re.DOTALL)
-    parsed_locations = [b for (a, b) in parsed_locations]
-    parsed_locations = [location.strip() for location in parsed_locations]
-
-    parsed_placement_locations = [location for location in parsed_locations if location.endswith('(p)')]
-    parsed_locations = [location.replace('(p)', '') for location in parsed_locations]
-    parsed_placement_locations = [location.replace('(p)', '') for location in parsed_placement_locations]
-    parsed_placement_locations = [location.strip() for location in parsed_placement_locations]
-    parsed_locations = [location.strip() for location in parsed_locations]
-
-    if parsed_locations:
-        return parsed_locations, parsed_placement_locations
-    else:
-        warnings.warn("List of locations is empty. Check content of location markdown file")
-        return []
-
-
-def parse_rooms(data):
-    parsed_rooms = re.findall(r'\|\s*(\w+ \w*)\s*\|', data, re.DOTALL)
-    parsed_rooms = [rooms.strip() for rooms in parsed_rooms]
-
-    if parsed_rooms:
-        return parsed_rooms[1:]
-    else:
-        warnings.warn("List of rooms is empty. Check content of room markdown file")
-        return []
-
-
-def parse_objects(data):
-    parsed_objects = re.findall(r'\|\s*(\w+)\s*\|', data, re.DOTALL)
-    parsed_objects = [objects for objects in parsed_objects if objects != 'Objectname']
-    parsed_objects = [objects.replace("_", " ") for objects in parsed_objects]
-    parsed_objects = [objects.strip() for objects in parsed_objects]
-
-    parsed_categories = re.findall(r'# Class \s*([\w,\s, \(,\)]+)\s*', data, re.DOTALL)
-    parsed_categories = [category.strip() for category in parsed_categories]
-    parsed_categories = [category.replace('(', '').replace(')', '').split() for category in parsed_categories]
-    parsed_categories_plural = [category[0] for category in parsed_categories]
-    parsed_categories_plural = [category.replace("_", " ") for category in parsed_categories_plural]
-    parsed_categories_singular = [category[1] for category in parsed_categories]
-    parsed_categories_singular = [category.replace("_", " ") for category in parsed_categories_singular]
-
-    if parsed_objects or parsed_categories:
-        return parsed_objects, parsed_categories_plural, parsed_categories_singular
-    else:
-        warnings.warn("List of objects or object categories is empty. Check content of object markdown file")
-        return []
+from seen_commands import SeenSet, BloomFilter, unique_records
+from world_model import load_world_model, WorldWatcher
+
+
+def write_commands(records, output, output_format="jsonl", chunk_size=1000):
+    if output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(["type", "category", "followups", "bindings", "text"])
+    records = iter(records)
+    while True:
+        # Only one chunk of records is held in memory at any time
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        if output_format == "csv":
+            writer.writerows([record["type"], record["category"], " ".join(record["followups"]),
+                              json.dumps(record["bindings"]), record["text"]] for record in chunk)
+        elif output_format == "text":
+            output.writelines([record + "\n" for record in chunk])
+        else:
+            output.writelines([json.dumps(record) + "\n" for record in chunk])
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate GPSR commands, runs interactively without --count")
+    parser.add_argument("--count", type=int, help="stream this many commands and exit, 0 streams until interrupted")
+    parser.add_argument("--category", choices=["", "people", "objects"], default="", help="command category")
+    parser.add_argument("--format", choices=["jsonl", "csv", "corpus"], default="jsonl",
+                        help="format of streamed commands, corpus is the memory mappable binary format of corpus.py")
+    parser.add_argument("--output", default="-", help="file to stream commands to, '-' for stdout")
+    parser.add_argument("--seed", type=int, help="seed for reproducible commands")
+    parser.add_argument("--unique", choices=["set", "bloom"],
+                        help="never stream the same command twice, using a set of 64 bit hash fingerprints or a "
+                             "bloom filter, both report the chance that a new command was wrongly dropped")
+    parser.add_argument("--unique-memory", type=int, default=1024, help="memory limit of --unique in MB")
+    parser.add_argument("--enumerate", action="store_true",
+                        help="stream every derivation of the grammar once and exit, with --unique every text once")
+    parser.add_argument("--space-size", action="store_true",
+                        help="print the number of derivations streamed by --enumerate and exit")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of generator processes, the stream does not depend on it")
+    parser.add_argument("--weights",
+                        help="JSON file with relative weights, {\"commands\": {type: weight}, \"categories\": "
+                             "{\"people\": weight, \"objects\": weight}}")
+    parser.add_argument("--stratify", action="store_true",
+                        help="split --count exactly evenly over the start command types")
+    parser.add_argument("--egpsr", action="store_true", help="stream structured EGPSR setups instead of commands")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload changed world files before every interactive command")
+    parser.add_argument("--addressable", action="store_true",
+                        help="draw every command from its own stream of (seed, index), so any one can be replayed alone")
+    parser.add_argument("--start", type=int, default=0, help="index of the first streamed command, to shard runs")
+    parser.add_argument("--replay", type=int, metavar="INDEX",
+                        help="print the command of this index in the stream of --seed and exit")
+    parser.add_argument("--world-cache", default=".world_model.cache",
+                        help="file caching the parsed world model, empty to always parse the markdown files")
+    args = parser.parse_args()
+    if args.egpsr and args.format != "jsonl":
+        parser.error("EGPSR setups are only streamed as jsonl")
+    if args.stratify and not args.count:
+        parser.error("--stratify needs a positive --count")
+    if args.replay is not None and args.seed is None:
+        parser.error("--replay needs the --seed of the stream")
+    if args.format == "corpus" and (args.output == "-" or args.unique or args.enumerate or args.stratify):
+        parser.error("corpus files need --output and cannot be combined with --unique, --enumerate or --stratify")
+    weights = {}
+    if args.weights:
+        with open(args.weights) as file:
+            weights = json.load(file)
+
     names_file_path = '../names/names.md'
     locations_file_path = '../maps/location_names.md'
     rooms_file_path = '../maps/room_names.md'
     objects_file_path = '../objects/objects.md'
 
-    names_data = read_data(names_file_path)
-    names = parse_names(names_data)
+    world_model = load_world_model(names_file_path, locations_file_path, rooms_file_path, objects_file_path,
+                                   cache_path=args.world_cache or None)
 
-    locations_data = read_data(locations_file_path)
-    location_names, placement_location_names = parse_locations(locations_data)
-
-    rooms_data = read_data(rooms_file_path)
-    room_names = parse_rooms(rooms_data)
+    watcher = WorldWatcher(names_file_path, locations_file_path, rooms_file_path, objects_file_path,
+                           world_model=world_model) if args.watch else None
+    try:
+        generator = CommandGenerator(*world_model.generator_args(), rng=random.Random(args.seed),
+                                     command_weights=weights.get("commands"),
+                                     category_weights=weights.get("categories"))
+    except ValueError as error:
+        parser.error(args.weights + ": " + str(error))
+    egpsr_generator = EgpsrCommandGenerator(generator)
 
-    objects_data = read_data(objects_file_path)
-    object_names, object_categories_plural, object_categories_singular = parse_objects(objects_data)
+    if args.space_size:
+        print(generator.count(cmd_category=args.category))
+        sys.exit()
+
+    if args.replay is not None:
+        print(json.dumps(generator.replay_record(args.seed, args.replay, args.category, args.addressable,
+                                                 start=args.start)))
+        sys.exit()
+
+    if args.format == "corpus" and args.count is not None:
+        # Workers send back encoded blocks of rows, which are appended to the file as they are
+        import corpus
+        writer = corpus.CorpusWriter(args.output, generator)
+        try:
+            for rows in generator.iter_parallel(args.count or None, cmd_category=args.category, seed=args.seed,
+                                                workers=args.workers, output="corpus", start=args.start,
+                                                addressable=args.addressable):
+                writer.write_rows(rows)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.close()
+        sys.exit()
+
+    if args.count is not None or args.enumerate:
+        if args.unique == "bloom":
+            seen = BloomFilter(capacity=args.count or 10 ** 7, max_bytes=args.unique_memory << 20)
+        elif args.unique:
+            seen = SeenSet(max_bytes=args.unique_memory << 20)
+        if args.enumerate:
+            # With --unique, texts of choices whose alternatives share values are only streamed once
+            records = generator.iter_all_commands(cmd_category=args.category, seen=seen if args.unique else None)
+            output_format = "text"
+        elif args.stratify:
+            records = generator.iter_stratified(generator.balanced_quotas(args.count, args.category),
+                                                cmd_category=args.category, seed=args.seed)
+            output_format = args.format
+        elif args.egpsr:
+            records = egpsr_generator.iter_setups(args.count or None, seed=args.seed)
+            output_format = "jsonl"
+        elif args.unique:
+            records = unique_records(generator.iter_parallel(None, cmd_category=args.category, seed=args.seed,
+                                                             workers=args.workers, start=args.start,
+                                                             addressable=args.addressable), seen)
+            records = itertools.islice(records, args.count or None)
+            output_format = args.format
+        else:
+            records = generator.iter_parallel(args.count or None, cmd_category=args.category, seed=args.seed,
+                                              workers=args.workers, start=args.start, addressable=args.addressable)
+            output_format = args.format
+        output = sys.stdout if args.output == "-" else open(args.output, "w", newline="", buffering=1 << 20)
+        try:
+            write_commands(records, output, output_format)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if args.unique:
+            print(json.dumps(seen.stats()), file=sys.stderr)
+        sys.exit()
 
-    generator = CommandGenerator(names, location_names, placement_location_names, room_names, object_names,
-                                 object_categories_plural, object_categories_singular)
-    egpsr_generator = EgpsrCommandGenerator(generator)
     user_prompt = "'1': Any command,\n" \
                   "'2': Command without manipulation,\n" \
                   "'3': Command with manipulation,\n" \
@@ -105,23 +167,31 @@ if __name__ == "__main__":
                   "'q': Quit"
     print(user_prompt)
     command = ""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=30,
-        border=4,
-    )
     last_input = '?'
+    batch_categories = {'1': "", '2': "people", '3': "objects"}
     try:
         while True:
             # Read user input
             user_input = input()
+            if watcher is not None:
+                updated_world_model = watcher.poll()
+                if updated_world_model is not None:
+                    generator.update_world(*updated_world_model.generator_args())
+                    egpsr_generator.compile_templates()
             
 
             #check optional arguments
             argument = re.search(r'-n\s+(\d+)', user_input)
             command_count = 1 if (argument is None) else int(argument.group(1))
 
+            if command_count > 1 and user_input[0] in batch_categories:
+                commands = generator.generate_batch(command_count, cmd_category=batch_categories[user_input[0]])
+                for command in commands:
+                    command = command[0].upper() + command[1:]
+                    print(command)
+                last_input = user_input[0]
+                continue
+
             for i in range(command_count):
                 # Check user input
                 if user_input[0] == '1':
@@ -139,7 +209,7 @@ if __name__ == "__main__":
                     command_three = generator.generate_command_start(cmd_category="")
                     command_list = [command_one[0].upper() + command_one[1:], command_two[0].upper() + command_two[1:],
                                     command_three[0].upper() + command_three[1:]]
-                    random.shuffle(command_list)
+                    generator.rng.shuffle(command_list)
                     command = command_list[0] + "\n" + command_list[1] + "\n" + command_list[2]
                     last_input = "4"
                 elif user_input[0] == "5":
@@ -152,28 +222,9 @@ if __name__ == "__main__":
                         commands = command_list
                     else:
                         commands = [command]
-                    for c in commands:
-                        qr.clear()
-                        qr.add_data(c)
-                        qr.make(fit=True)
-
-                        img = qr.make_image(fill_color="black", back_color="white")
-                        # Create a drawing object
-                        draw = ImageDraw.Draw(img)
-
-                        # Load a font
-                        font = ImageFont.truetype("Arial.ttf", 30)
-
-                        # Calculate text size and position
-                        text_size = draw.textsize(c, font)
-                        if text_size[0] > img.size[0]:
-                            font = ImageFont.truetype("Arial.ttf", 15)
-                            text_size = draw.textsize(c, font)
-                        text_position = ((img.size[0] - text_size[0]) // 2, img.size[1] - text_size[1] - 10)
-
-                        # Draw text on the image
-                        draw.text(text_position, c, font=font, fill="black")
-                        img.show()
+                    # Imaging libraries are only loaded once a QR code is requested
+                    import qr_codes
+                    qr_codes.show_qr_codes(commands)
                 else:
                     print(user_prompt)
                     break
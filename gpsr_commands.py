@@ -2,12 +2,126 @@ import random
 import re
 import itertools
 import warnings
+import collections
+import copy
+import multiprocessing
+import os
+from seen_commands import SeenSet, unique_records
+
+# Kinds of compiled placeholder tokens, literal text is kept as plain strings
+SLOT, CHOICE, ARTICLE, DISTINCT, ENTITY = range(5)
+
+# Generator used by the processes of a parallel generation pool
+worker_generator = None
+
+
+def init_worker(generator):
+    global worker_generator
+    worker_generator = generator
+
+
+def chunk_seed(seed, start):
+    # Chunked and addressable streams derive their seeds apart, so that shards of both never share a command
+    return "chunk:%s:%d" % (seed, start)
+
+
+def index_seed(seed, index):
+    return "index:%s:%d" % (seed, index)
+
+
+def generate_worker_chunk(n, cmd_category, seed, start, output, addressable=False):
+    if addressable:
+        commands = [worker_generator.command_at(seed, index, cmd_category) for index in range(start, start + n)]
+        if output == "records":
+            return [dict(command.to_dict(), seed=seed, index=index) for index, command in enumerate(commands, start)]
+        if output == "texts":
+            return [command.text for command in commands]
+    else:
+        # The chunk draws from one stream derived from the seed and the index of its first command
+        seed = chunk_seed(seed, start)
+        if output == "records":
+            return list(worker_generator.iter_commands(n, cmd_category, seed))
+        if output == "texts":
+            return worker_generator.generate_batch(n, cmd_category, seed)
+        commands = worker_generator.generate_commands(n, cmd_category, seed)
+    # The chunk is encoded in the worker and sent back as a single block of corpus rows
+    import corpus
+    return [corpus.encode_commands(worker_generator, commands)]
+
+
+# Generated command stored as the chosen indices, the text is only rendered when asked for
+class Command:
+    __slots__ = ("generator", "category", "chain", "template", "decisions", "rendered")
+
+    def __init__(self, generator, category, chain, template, decisions):
+        self.generator = generator
+        self.category = category
+        # Start command followed by its followups
+        self.chain = chain
+        # Tokens the decisions were drawn for, commands keep their text when the world model is reloaded
+        self.template = template
+        # Alternative of every choice and vocabulary index of every slot of the chain template in token order,
+        # -1 for exhausted entities
+        self.decisions = decisions
+        self.rendered = None
+
+    @property
+    def cmd_type(self):
+        return self.chain[0]
+
+    @property
+    def followups(self):
+        return list(self.chain[1:])
+
+    @property
+    def text(self):
+        if self.rendered is None:
+            self.rendered = self.generator.replay_templates([self.template], self.decisions)
+        return self.rendered
+
+    @property
+    def bindings(self):
+        bindings = []
+        self.generator.replay_templates([self.template], self.decisions, bindings)
+        return bindings
+
+    def to_dict(self):
+        bindings = []
+        text = self.generator.replay_templates([self.template], self.decisions, bindings)
+        return {"type": self.chain[0], "category": self.category, "followups": list(self.chain[1:]),
+                "bindings": bindings, "text": text}
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return "Command(%r, %r)" % (self.chain, self.text)
+
+
+def build_alias_table(distribution):
+    # Vose's alias method, every draw then takes a single uniform number whatever the number of entries
+    entries = [entry for entry, _ in distribution]
+    total = sum(p for _, p in distribution)
+    scaled = [p * len(entries) / total for _, p in distribution]
+    probabilities = [1.0] * len(entries)
+    aliases = list(range(len(entries)))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        probabilities[i] = scaled[i]
+        aliases[i] = j
+        scaled[j] -= 1.0 - scaled[i]
+        (small if scaled[j] < 1.0 else large).append(j)
+    return entries, probabilities, aliases
 
 
 class CommandGenerator:
 
     def __init__(self, person_names, location_names, placement_location_names, room_names, object_names,
-                 object_categories_plural, object_categories_singular):
+                 object_categories_plural, object_categories_singular, rng=None, command_weights=None,
+                 category_weights=None):
         self.person_names = person_names
         self.location_names = location_names
         self.placement_location_names = placement_location_names
@@ -15,6 +129,12 @@ class CommandGenerator:
         self.object_names = object_names
         self.object_categories_plural = object_categories_plural
         self.object_categories_singular = object_categories_singular
+        # Every random draw goes through this generator, any object with the random.Random interface works
+        self.rng = random.Random() if rng is None else rng
+        self.compile_world()
+        # Set by enable_profiling, instrumented methods then shadow the plain ones on this instance
+        self.profile = None
+        self.set_weights(command_weights, category_weights)
 
     verb_dict = {
         "take": ["take", "get", "grasp", "fetch"],
@@ -77,273 +197,762 @@ class CommandGenerator:
     for (a, b) in list(itertools.product(color_list, clothes_list)):
         color_clothes_list = color_clothes_list + [a + " " + b]
 
-    def generate_command_start(self, cmd_category="", difficulty=0):
-        cmd_list = []
-        # cmd_list = ["goToLoc", "takeObjFromPlcmt", "findPrsInRoom", "findObjInRoom", "meetPrsAtBeac", "countObjOnPlcmt",
-        #             "countPrsInRoom", "tellPrsInfoInLoc", "tellObjPropOnPlcmt", "talkInfoToGestPrsInRoom",
-        #             "answerToGestPrsInRoom", "followNameFromBeacToRoom", "guideNameFromBeacToBeac",
-        #             "guidePrsFromBeacToBeac", "guideClothPrsFromBeacToBeac", "bringMeObjFromPlcmt",
-        #             "tellCatPropOnPlcmt", "greetClothDscInRm", "greetNameInRm", "meetNameAtLocThenFindInRm",
-        #             "countClothPrsInRoom", "countClothPrsInRoom", "tellPrsInfoAtLocToPrsAtLoc", "followPrsAtLoc"]
-
-        # HRI and people perception commands
-        person_cmd_list = ["goToLoc", "findPrsInRoom", "meetPrsAtBeac", "countPrsInRoom", "tellPrsInfoInLoc",
-                           "talkInfoToGestPrsInRoom", "answerToGestPrsInRoom", "followNameFromBeacToRoom",
-                           "guideNameFromBeacToBeac", "guidePrsFromBeacToBeac", "guideClothPrsFromBeacToBeac",
-                           "greetClothDscInRm", "greetNameInRm", "meetNameAtLocThenFindInRm", "countClothPrsInRoom",
-                           "countClothPrsInRoom", "tellPrsInfoAtLocToPrsAtLoc", "followPrsAtLoc"]
-        # Object manipulation and perception commands
-        object_cmd_list = ["goToLoc", "takeObjFromPlcmt", "findObjInRoom", "countObjOnPlcmt", "tellObjPropOnPlcmt",
-                           "bringMeObjFromPlcmt", "tellCatPropOnPlcmt"]
-
-        if cmd_category == "people":
-            cmd_list = person_cmd_list
-        elif cmd_category == "objects":
-            cmd_list = object_cmd_list
-        else:
-            cmd_list = person_cmd_list if random.random() > 0.5 else object_cmd_list
-
-        command = random.choice(cmd_list)
-        # command = "" # To debug commands
-        command_string = ""
-        if command == "goToLoc":
-            command_string = "{goVerb} {toLocPrep} the {loc_room} then " + \
-                             self.generate_command_followup("atLoc", cmd_category, difficulty)
-        elif command == "takeObjFromPlcmt":
-            command_string = "{takeVerb} {art} {obj_singCat} {fromLocPrep} the {plcmtLoc} and " + \
-                             self.generate_command_followup("hasObj", cmd_category, difficulty)
-        elif command == "findPrsInRoom":
-            command_string = "{findVerb} a {gestPers_posePers} {inLocPrep} the {room} and " + \
-                             self.generate_command_followup("foundPers", cmd_category, difficulty)
-        elif command == "findObjInRoom":
-            command_string = "{findVerb} {art} {obj_singCat} {inLocPrep} the {room} then " + \
-                             self.generate_command_followup("foundObj", cmd_category, difficulty)
-        elif command == "meetPrsAtBeac":
-            command_string = "{meetVerb} {name} {inLocPrep} the {room} and " + \
-                             self.generate_command_followup("foundPers", cmd_category, difficulty)
-        elif command == "countObjOnPlcmt":
-            command_string = "{countVerb} {plurCat} there are {onLocPrep} the {plcmtLoc}"
-        elif command == "countPrsInRoom":
-            command_string = "{countVerb} {gestPersPlur_posePersPlur} are {inLocPrep} the {room}"
-        elif command == "tellPrsInfoInLoc":
-            command_string = "{tellVerb} me the {persInfo} of the person {inRoom_atLoc}"
-        elif command == "tellObjPropOnPlcmt":
-            command_string = "{tellVerb} me what is the {objComp} object {onLocPrep} the {plcmtLoc}"
-        elif command == "talkInfoToGestPrsInRoom":
-            command_string = "{talkVerb} {talk} {talkPrep} the {gestPers} {inLocPrep} the {room}"
-        elif command == "answerToGestPrsInRoom":
-            command_string = "{answerVerb} the {question} {ofPrsPrep} the {gestPers} {inLocPrep} the {room}"
-        elif command == "followNameFromBeacToRoom":
-            command_string = "{followVerb} {name} {fromLocPrep} the {loc} {toLocPrep} the {room}"
-        elif command == "guideNameFromBeacToBeac":
-            command_string = "{guideVerb} {name} {fromLocPrep} the {loc} {toLocPrep} the {loc_room}"
-        elif command == "guidePrsFromBeacToBeac":
-            command_string = "{guideVerb} the {gestPers_posePers} {fromLocPrep} the {loc} {toLocPrep} the {loc_room}"
-        elif command == "guideClothPrsFromBeacToBeac":
-            command_string = "{guideVerb} the person wearing a {colorClothe} {fromLocPrep} the {loc} {toLocPrep} the {loc_room}"
-        elif command == "bringMeObjFromPlcmt":
-            command_string = "{bringVerb} me {art} {obj} {fromLocPrep} the {plcmtLoc}"
-        elif command == "tellCatPropOnPlcmt":
-            command_string = "{tellVerb} me what is the {objComp} {singCat} {onLocPrep} the {plcmtLoc}"
-        elif command == "greetClothDscInRm":
-            command_string = "{greetVerb} the person wearing {art} {colorClothe} {inLocPrep} the {room} and " + \
-                             self.generate_command_followup("foundPers", cmd_category, difficulty)
-        elif command == "greetNameInRm":
-            command_string = "{greetVerb} {name} {inLocPrep} the {room} and " + \
-                             self.generate_command_followup("foundPers", cmd_category, difficulty)
-        elif command == "meetNameAtLocThenFindInRm":
-            command_string = "{meetVerb} {name} {atLocPrep} the {loc} then {findVerb} them {inLocPrep} the {room}"
-        elif command == "countClothPrsInRoom":
-            command_string = "{countVerb} people {inLocPrep} the {room} are wearing {colorClothes}"
-        elif command == "countClothPrsInRoom":
-            command_string = "{countVerb} people {inLocPrep} the {room} are wearing {colorClothes}"
-        elif command == "tellPrsInfoAtLocToPrsAtLoc":
-            command_string = "{tellVerb} the {persInfo} of the person {atLocPrep} the {loc} to the person {atLocPrep} the {loc2}"
-        elif command == "followPrsAtLoc":
-            command_string = "{followVerb} the {gestPers_posePers} {inRoom_atLoc}"
+    # HRI and people perception commands
+    person_cmd_list = ["goToLoc", "findPrsInRoom", "meetPrsAtBeac", "countPrsInRoom", "tellPrsInfoInLoc",
+                       "talkInfoToGestPrsInRoom", "answerToGestPrsInRoom", "followNameFromBeacToRoom",
+                       "guideNameFromBeacToBeac", "guidePrsFromBeacToBeac", "guideClothPrsFromBeacToBeac",
+                       "greetClothDscInRm", "greetNameInRm", "meetNameAtLocThenFindInRm", "countClothPrsInRoom",
+                       "countClothPrsInRoom", "tellPrsInfoAtLocToPrsAtLoc", "followPrsAtLoc"]
+    # Object manipulation and perception commands
+    object_cmd_list = ["goToLoc", "takeObjFromPlcmt", "findObjInRoom", "countObjOnPlcmt", "tellObjPropOnPlcmt",
+                       "bringMeObjFromPlcmt", "tellCatPropOnPlcmt"]
+    start_cmd_lists = {"people": person_cmd_list, "objects": object_cmd_list}
+
+    # Commands that may follow a command ending in the given followup type
+    followup_cmd_lists = {
+        "atLoc": {"people": ["findPrs", "meetName"], "objects": ["findObj"]},
+        "hasObj": {"": ["placeObjOnPlcmt", "deliverObjToMe", "deliverObjToPrsInRoom", "deliverObjToNameAtBeac"]},
+        "foundPers": {"": ["talkInfo", "answerQuestion", "followPrs", "followPrsToRoom", "guidePrsToBeacon"]},
+        "foundObj": {"": ["takeObj"]}
+    }
+
+    # Command type -> (template, followup type appended to the template or None)
+    command_templates = {
+        "goToLoc": ("{goVerb} {toLocPrep} the {loc_room} then ", "atLoc"),
+        "takeObjFromPlcmt": ("{takeVerb} {art} {obj_singCat} {fromLocPrep} the {plcmtLoc} and ", "hasObj"),
+        "findPrsInRoom": ("{findVerb} a {gestPers_posePers} {inLocPrep} the {room} and ", "foundPers"),
+        "findObjInRoom": ("{findVerb} {art} {obj_singCat} {inLocPrep} the {room} then ", "foundObj"),
+        "meetPrsAtBeac": ("{meetVerb} {name} {inLocPrep} the {room} and ", "foundPers"),
+        "countObjOnPlcmt": ("{countVerb} {plurCat} there are {onLocPrep} the {plcmtLoc}", None),
+        "countPrsInRoom": ("{countVerb} {gestPersPlur_posePersPlur} are {inLocPrep} the {room}", None),
+        "tellPrsInfoInLoc": ("{tellVerb} me the {persInfo} of the person {inRoom_atLoc}", None),
+        "tellObjPropOnPlcmt": ("{tellVerb} me what is the {objComp} object {onLocPrep} the {plcmtLoc}", None),
+        "talkInfoToGestPrsInRoom": ("{talkVerb} {talk} {talkPrep} the {gestPers} {inLocPrep} the {room}", None),
+        "answerToGestPrsInRoom": ("{answerVerb} the {question} {ofPrsPrep} the {gestPers} {inLocPrep} the {room}",
+                                  None),
+        "followNameFromBeacToRoom": ("{followVerb} {name} {fromLocPrep} the {loc} {toLocPrep} the {room}", None),
+        "guideNameFromBeacToBeac": ("{guideVerb} {name} {fromLocPrep} the {loc} {toLocPrep} the {loc_room}", None),
+        "guidePrsFromBeacToBeac": ("{guideVerb} the {gestPers_posePers} {fromLocPrep} the {loc} {toLocPrep} the "
+                                   "{loc_room}", None),
+        "guideClothPrsFromBeacToBeac": ("{guideVerb} the person wearing a {colorClothe} {fromLocPrep} the {loc} "
+                                        "{toLocPrep} the {loc_room}", None),
+        "bringMeObjFromPlcmt": ("{bringVerb} me {art} {obj} {fromLocPrep} the {plcmtLoc}", None),
+        "tellCatPropOnPlcmt": ("{tellVerb} me what is the {objComp} {singCat} {onLocPrep} the {plcmtLoc}", None),
+        "greetClothDscInRm": ("{greetVerb} the person wearing {art} {colorClothe} {inLocPrep} the {room} and ",
+                              "foundPers"),
+        "greetNameInRm": ("{greetVerb} {name} {inLocPrep} the {room} and ", "foundPers"),
+        "meetNameAtLocThenFindInRm": ("{meetVerb} {name} {atLocPrep} the {loc} then {findVerb} them {inLocPrep} "
+                                      "the {room}", None),
+        "countClothPrsInRoom": ("{countVerb} people {inLocPrep} the {room} are wearing {colorClothes}", None),
+        "tellPrsInfoAtLocToPrsAtLoc": ("{tellVerb} the {persInfo} of the person {atLocPrep} the {loc} to the "
+                                       "person {atLocPrep} the {loc2}", None),
+        "followPrsAtLoc": ("{followVerb} the {gestPers_posePers} {inRoom_atLoc}", None),
+
+        # Followup commands
+        "findObj": ("{findVerb} {art} {obj_singCat} and ", "foundObj"),
+        "findPrs": ("{findVerb} the {gestPers_posePers} and ", "foundPers"),
+        "meetName": ("{meetVerb} {name} and ", "foundPers"),
+        "placeObjOnPlcmt": ("{placeVerb} it {onLocPrep} the {plcmtLoc2}", None),
+        "deliverObjToMe": ("{deliverVerb} it to me", None),
+        "deliverObjToPrsInRoom": ("{deliverVerb} it {deliverPrep} the {gestPers_posePers} {inLocPrep} the {room}",
+                                  None),
+        "deliverObjToNameAtBeac": ("{deliverVerb} it {deliverPrep} {name} {inLocPrep} the {room}", None),
+        "talkInfo": ("{talkVerb} {talk}", None),
+        "answerQuestion": ("{answerVerb} a {question}", None),
+        "followPrs": ("{followVerb} them", None),
+        "followPrsToRoom": ("{followVerb} them {toLocPrep} the {loc2_room2}", None),
+        "guidePrsToBeacon": ("{guideVerb} them {toLocPrep} the {loc2_room2}", None),
+        "takeObj": ("{takeVerb} it and ", "hasObj")
+    }
+
+    # Number of followup chains whose merged templates are kept
+    chain_cache_size = 1024
+
+    # Placeholders that expand to a template of other placeholders
+    placeholder_macros = {
+        "inRoom": "{inLocPrep} the {room}",
+        "atLoc": "{atLocPrep} the {loc}"
+    }
+
+    # Placeholders that must differ from the entities already mentioned in the command
+    distinct_placeholders = {
+        "loc2": "loc",
+        "room2": "room",
+        "plcmtLoc2": "plcmtLoc"
+    }
+
+    # Placeholders naming the same kind of entity, a distinct placeholder differs from all others of its kind
+    entity_placeholders = {
+        "loc": "location",
+        "plcmtLoc": "location",
+        "room": "room"
+    }
+
+    def compile_world(self):
+        self.placeholder_dict = self.build_placeholder_dict()
+        # Positions of every entity value in its vocabulary, to draw distinct entities by index
+        self.entity_indexes = {base: self.build_index(self.placeholder_dict[base]) for base in self.entity_placeholders}
+        self.compiled_templates = {command: (self.compile_template(template), followup)
+                                   for command, (template, followup) in self.command_templates.items()}
+        # Command chain -> tokens of the whole chain, least recently used chains are dropped first
+        self.chain_templates = collections.OrderedDict()
+        # Vectorized batch tables per command category, filled by numpy_backend on first use
+        self.compiled_shapes = {}
+
+    def update_world(self, person_names, location_names, placement_location_names, room_names, object_names,
+                     object_categories_plural, object_categories_singular):
+        # Everything derived from the vocabulary is built on a copy and swapped in with a single dict update,
+        # so a command is always drawn from either the old or the new world, never a mix of both
+        updated = copy.copy(self)
+        updated.person_names = person_names
+        updated.location_names = location_names
+        updated.placement_location_names = placement_location_names
+        updated.room_names = room_names
+        updated.object_names = object_names
+        updated.object_categories_plural = object_categories_plural
+        updated.object_categories_singular = object_categories_singular
+        updated.compile_world()
+        self.__dict__.update(updated.__dict__)
+
+    def build_placeholder_dict(self):
+        placeholder_dict = {verb + "Verb": verbs for verb, verbs in self.verb_dict.items()}
+        placeholder_dict.update(self.prep_dict)
+        placeholder_dict.update({
+            "connector": self.connector_list,
+            "plcmtLoc": self.placement_location_names,
+            "room": self.room_names,
+            "loc": self.location_names,
+            "gestPers": self.gesture_person_list,
+            "posePers": self.pose_person_list,
+            "name": self.person_names,
+            "gestPersPlur": self.gesture_person_plural_list,
+            "posePersPlur": self.pose_person_plural_list,
+            "persInfo": self.person_info_list,
+            "obj": self.object_names,
+            "singCat": self.object_categories_singular,
+            "plurCat": self.object_categories_plural,
+            "objComp": self.object_comp_list,
+            "talk": self.talk_list,
+            "question": self.question_list,
+            "colorClothe": self.color_clothe_list,
+            "colorClothes": self.color_clothes_list
+        })
+        return placeholder_dict
+
+    def build_index(self, vocab):
+        index = collections.defaultdict(list)
+        for i, value in enumerate(vocab):
+            index[value].append(i)
+        return dict(index)
+
+    def entity_kind(self, ph):
+        return self.entity_placeholders.get(self.distinct_placeholders.get(ph, ph))
+
+    def compile_template(self, template):
+        tokens = []
+        for i, part in enumerate(re.split(r'\{(\w+)\}', template)):
+            if i % 2 == 0:
+                compiled = [part] if part else []
+            elif part in self.placeholder_macros:
+                compiled = self.compile_template(self.placeholder_macros[part])
+            else:
+                compiled = [self.compile_placeholder(part)]
+            for token in compiled:
+                self.append_token(tokens, token)
+        return tokens
+
+    def append_token(self, tokens, token):
+        # Merge neighbouring literals so rendering appends as few parts as possible
+        if tokens and isinstance(token, str) and isinstance(tokens[-1], str):
+            tokens[-1] += token
         else:
-            warnings.warn("Command type not covered: " + command)
-            return "WARNING"
-
-        for ph in re.findall(r'(\{\w+\})', command_string, re.DOTALL):
-            command_string = command_string.replace(ph, self.insert_placeholders(ph))
-
-        # TODO allow multiple articles
-        art_ph = re.findall(r'\{(art)\}\s*([A-Za-z])', command_string, re.DOTALL)
-        if art_ph:
-            command_string = command_string.replace("art",
-                                                    "an" if art_ph[0][1].lower() in ["a", "e", "i", "o", "u"] else "a")
-        # TODO eliminate double mentions of location
-        if "loc2" in command_string:
-            command_string = command_string.replace("loc2", random.choice(
-                [x for x in self.location_names if x not in command_string]))
-        elif "room2" in command_string:
-            command_string = command_string.replace("room2", random.choice(
-                [x for x in self.room_names if x not in command_string]))
-        elif "plcmtLoc2" in command_string:
-            command_string = command_string.replace("plcmtLoc2", random.choice(
-                [x for x in self.placement_location_names if x not in command_string]))
-        return command_string.replace('{', '').replace('}', '')
+            tokens.append(token)
+
+    def chain_template(self, chain):
+        # Tokens of a whole followup chain, kept for the most recently used chains
+        tokens = self.chain_templates.get(chain)
+        if tokens is not None:
+            self.chain_templates.move_to_end(chain)
+            return tokens
+        tokens = self.merge_chain(chain)[0]
+        self.chain_templates[chain] = tokens
+        if len(self.chain_templates) > self.chain_cache_size:
+            self.chain_templates.popitem(last=False)
+        return tokens
+
+    def merge_chain(self, chain):
+        # Tokens of the chain and the number of tokens once each of its commands is merged in
+        tokens = []
+        ends = []
+        for command in chain:
+            for token in self.compiled_templates[command][0]:
+                self.append_token(tokens, self.bind_fixed(token))
+            ends.append(len(tokens))
+        return tokens, ends
+
+    def bind_fixed(self, token):
+        # Slots with a single value are written into the template instead of being drawn every time
+        if token.__class__ is str:
+            return token
+        if token[0] == SLOT and len(set(token[2])) == 1:
+            return token[2][0]
+        if token[0] == CHOICE:
+            alternatives = []
+            for alternative in token[1]:
+                bound = []
+                for other in alternative:
+                    self.append_token(bound, self.bind_fixed(other))
+                alternatives.append(bound)
+            return CHOICE, tuple(alternatives)
+        return token
+
+    def compile_placeholder(self, ph):
+        if len(ph.split('_')) > 1:
+            return CHOICE, tuple(self.compile_template("{" + alternative + "}") for alternative in ph.split('_'))
+        if ph == "art":
+            return ARTICLE,
+        if ph in self.distinct_placeholders:
+            base = self.distinct_placeholders[ph]
+            return DISTINCT, ph, self.placeholder_dict[base], self.entity_placeholders[base], base
+        if ph in self.entity_placeholders:
+            return ENTITY, ph, self.placeholder_dict[ph], self.entity_placeholders[ph], ph
+        if ph in self.placeholder_dict:
+            return SLOT, ph, self.placeholder_dict[ph]
+        warnings.warn("Placeholder not covered: " + ph)
+        return "WARNING"
+
+    def enable_profiling(self, profile=None):
+        # Only instruments this process, a pool of workers profiles nothing
+        import profiling
+        if self.profile is not None:
+            self.disable_profiling()
+        self.profile = profiling.GeneratorProfile() if profile is None else profile
+        self.profile.attach(self)
+        return self.profile
+
+    def disable_profiling(self):
+        if self.profile is not None:
+            self.profile.detach(self)
+            self.profile = None
+
+    def fork(self, seed=None):
+        # Shares the vocabulary and compiled templates, but draws from its own random stream. The chain cache is
+        # reordered on every lookup, a fork keeps its own copy so that it can generate in another thread
+        forked = copy.copy(self)
+        forked.rng = random.Random(seed)
+        forked.chain_templates = collections.OrderedDict(self.chain_templates)
+        return forked
+
+    def set_weights(self, command_weights=None, category_weights=None):
+        # Relative weights of command types, start and followup commands alike, and of the people and objects
+        # categories. Without weights the command lists are sampled as written, duplicates included
+        for command in command_weights or {}:
+            if command not in self.command_templates:
+                warnings.warn("Weight given for unknown command type: " + command)
+        weights = list((command_weights or {}).values()) + list((category_weights or {}).values())
+        if any(weight < 0 for weight in weights):
+            raise ValueError("Weights must not be negative")
+        if category_weights is not None and sum(category_weights.get(category, 1.0)
+                                                for category in self.start_cmd_lists) <= 0:
+            raise ValueError("Category weights leave no category to draw commands from")
+        if command_weights is not None:
+            # Every list must keep a command to draw, whichever category is asked for
+            for followup, cmd_lists in [(None, self.start_cmd_lists)] + list(self.followup_cmd_lists.items()):
+                for category, cmd_list in cmd_lists.items():
+                    if sum(command_weights.get(command, 1.0) for command in set(cmd_list)) <= 0:
+                        raise ValueError("Command weights leave no " + (category + " " if category else "") +
+                                         ("start command" if followup is None else "command following " + followup))
+        self.command_weights = command_weights
+        self.category_weights = category_weights
+        # Alias tables per (followup type or None for start commands, command category), built on first use
+        self.alias_tables = {}
+        self.compiled_shapes = {}
+
+    def cmd_lists(self, followup=None):
+        return self.start_cmd_lists if followup is None else self.followup_cmd_lists[followup]
+
+    def choose_command(self, followup=None, cmd_category="", rng=None):
+        # Picks (category, command) among the start commands or the commands following the given followup type
+        if rng is None:
+            rng = self.rng
+        cmd_lists = self.cmd_lists(followup)
+        if self.command_weights is None and self.category_weights is None:
+            # Same draws as before weights existed, so seeded streams stay the same
+            if cmd_category in cmd_lists:
+                category = cmd_category
+            elif len(cmd_lists) == 1:
+                category = next(iter(cmd_lists))
+            else:
+                category = "people" if rng.random() > 0.5 else "objects"
+            return category, rng.choice(cmd_lists[category])
+        key = (followup, cmd_category)
+        if key not in self.alias_tables:
+            self.alias_tables[key] = build_alias_table(
+                [((category, command), p) for category, command, p in self.command_distribution(cmd_lists, cmd_category)])
+        entries, probabilities, aliases = self.alias_tables[key]
+        u = rng.random() * len(entries)
+        i = int(u)
+        return entries[i] if u - i < probabilities[i] else entries[aliases[i]]
+
+    def generate_command_start(self, cmd_category="", difficulty=0):
+        return self.render_command(self.choose_command(None, cmd_category)[1], cmd_category)
 
     def generate_command_followup(self, type, cmd_category="", difficulty=0):
-        if type == "atLoc":
-            person_cmd_list = ["findPrs", "meetName"]
-            object_cmd_list = ["findObj"]
-            if cmd_category == "people":
-                cmd_list = person_cmd_list
-            elif cmd_category == "objects":
-                cmd_list = object_cmd_list
+        return self.render_command(self.choose_command(type, cmd_category)[1], cmd_category)
+
+    def generate_batch(self, n, cmd_category="", seed=None, backend="python"):
+        if backend not in ["python", "numpy"]:
+            raise ValueError("unknown backend " + str(backend) + ", expected python or numpy")
+        if backend == "numpy":
+            # Optional dependency, only imported when the vectorized backend is asked for
+            import numpy_backend
+            return numpy_backend.generate_batch(self, n, cmd_category, self.rng.getrandbits(64) if seed is None else seed)
+        # Draws exactly like generate_commands, so a seed gives the same commands as records, texts or a corpus
+        rng = self.rng if seed is None else random.Random(seed)
+        choose_command = self.choose_command
+        render_command = self.render_command
+        return [render_command(choose_command(None, cmd_category, rng)[1], cmd_category, rng) for _ in range(n)]
+
+    def iter_commands(self, n=None, cmd_category="", seed=None):
+        rng = self.rng if seed is None else random.Random(seed)
+        for _ in (itertools.count() if n is None else range(n)):
+            yield self.generate_record(cmd_category, rng)
+
+    def command_at(self, seed, index, cmd_category=""):
+        # Every index has its own stream derived from the seed, so any command is drawn without the ones before it
+        return self.generate_command(cmd_category, random.Random(index_seed(seed, index)))
+
+    def replay_record(self, seed, index, cmd_category="", addressable=False, chunk_size=10000, start=0):
+        # Record number index of iter_parallel with the same arguments, at most its chunk is generated again
+        if addressable:
+            return dict(self.command_at(seed, index, cmd_category).to_dict(), seed=seed, index=index)
+        chunk_start = index - (index - start) % chunk_size
+        records = self.iter_commands(index - chunk_start + 1, cmd_category, chunk_seed(seed, chunk_start))
+        return next(itertools.islice(records, index - chunk_start, None))
+
+    def iter_stratified(self, quotas, cmd_category="", seed=None):
+        # Exactly quotas[command] commands starting with every command type, the followups are drawn as usual
+        rng = self.rng if seed is None else random.Random(seed)
+        start_commands = self.command_space(self.start_cmd_lists, cmd_category)
+        remaining = {}
+        for command, quota in quotas.items():
+            if command in start_commands:
+                remaining[command] = max(quota, 0)
             else:
-                cmd_list = person_cmd_list if random.random() > 0.5 else object_cmd_list
-        elif type == "hasObj":
-            cmd_list = ["placeObjOnPlcmt", "deliverObjToMe", "deliverObjToPrsInRoom", "deliverObjToNameAtBeac"]
-        elif type == "foundPers":
-            cmd_list = ["talkInfo", "answerQuestion", "followPrs", "followPrsToRoom", "guidePrsToBeacon"]
-        elif type == "foundObj":
-            cmd_list = ["takeObj"]
-
-        command = random.choice(cmd_list)
-        command_string = ""
-        if command == "findObj":
-            command_string = "{findVerb} {art} {obj_singCat} and " + \
-                             self.generate_command_followup("foundObj")
-        elif command == "findPrs":
-            command_string = "{findVerb} the {gestPers_posePers} and " + \
-                             self.generate_command_followup("foundPers")
-        elif command == "meetName":
-            command_string = "{meetVerb} {name} and " + \
-                             self.generate_command_followup("foundPers")
-        elif command == "placeObjOnPlcmt":
-            command_string = "{placeVerb} it {onLocPrep} the {plcmtLoc2}"
-        elif command == "deliverObjToMe":
-            command_string = "{deliverVerb} it to me"
-        elif command == "deliverObjToPrsInRoom":
-            command_string = "{deliverVerb} it {deliverPrep} the {gestPers_posePers} {inLocPrep} the {room}"
-        elif command == "deliverObjToNameAtBeac":
-            command_string = "{deliverVerb} it {deliverPrep} {name} {inLocPrep} the {room}"
-        elif command == "talkInfo":
-            command_string = "{talkVerb} {talk}}"
-        elif command == "answerQuestion":
-            command_string = "{answerVerb} a {question}"
-        elif command == "followPrs":
-            command_string = "{followVerb} them"
-        elif command == "followPrsToRoom":
-            command_string = "{followVerb} them {toLocPrep} the {loc2_room2}"
-        elif command == "guidePrsToBeacon":
-            command_string = "{guideVerb} them {toLocPrep} the {loc2_room2}"
-        elif command == "takeObj":
-            command_string = "{takeVerb} it and " + \
-                             self.generate_command_followup("hasObj")
+                warnings.warn("Quota given for a command that cannot start a command: " + command)
+        total = sum(remaining.values())
+        while total > 0:
+            # Drawing types in proportion to what is left of their quotas shuffles the order uniformly
+            r = rng.randrange(total)
+            for command, quota in remaining.items():
+                if r < quota:
+                    break
+                r -= quota
+            remaining[command] -= 1
+            total -= 1
+            yield self.generate_command(cmd_category, rng, command).to_dict()
+
+    def balanced_quotas(self, n, cmd_category=""):
+        # n commands split as evenly as possible over the start command types
+        start_commands = self.command_space(self.start_cmd_lists, cmd_category)
+        return {command: n // len(start_commands) + (i < n % len(start_commands))
+                for i, command in enumerate(start_commands)}
+
+    def iter_unique_commands(self, n=None, cmd_category="", seed=None, seen=None, max_rejections=100000):
+        # Never yields two commands with the same bindings, pass a BloomFilter as seen for very large runs
+        if seen is None:
+            seen = SeenSet()
+        records = unique_records(self.iter_commands(None, cmd_category, seed), seen, max_rejections)
+        return records if n is None else itertools.islice(records, n)
+
+    def iter_parallel(self, n=None, cmd_category="", seed=None, workers=None, chunk_size=10000, output="records",
+                      start=0, addressable=False):
+        # output is "records" for record dicts, "texts" for command strings or "corpus" for blocks of corpus rows.
+        # Addressable streams draw every command from its own stream, so that command_at can replay any of them
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        workers = workers or os.cpu_count()
+        stop = None if n is None else start + n
+        starts = itertools.count(start, chunk_size) if n is None else range(start, stop, chunk_size)
+        # Each chunk draws from streams derived from the master seed and the indexes of its commands,
+        # so the output only depends on the seed and the chunk size, never on the number of workers
+        tasks = ((chunk_size if n is None else min(chunk_size, stop - chunk_start), cmd_category, seed, chunk_start,
+                  output, addressable) for chunk_start in starts)
+        if workers == 1:
+            init_worker(self)
+            for task in tasks:
+                yield from generate_worker_chunk(*task)
+            return
+        pending = collections.deque()
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(self,)) as pool:
+            for task in tasks:
+                pending.append(pool.apply_async(generate_worker_chunk, task))
+                # Bound the number of chunks in flight to keep memory flat for unbounded runs
+                if len(pending) > 2 * workers:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+
+    def generate_parallel(self, n, cmd_category="", seed=None, workers=None, chunk_size=10000, start=0,
+                          addressable=False):
+        # Texts of the records iter_parallel streams with the same arguments, replay_record gives any of them back
+        return list(self.iter_parallel(n, cmd_category, seed, workers, chunk_size, "texts", start, addressable))
+
+    def generate_commands(self, n, cmd_category="", seed=None):
+        rng = self.rng if seed is None else random.Random(seed)
+        return [self.generate_command(cmd_category, rng) for _ in range(n)]
+
+    def generate_record(self, cmd_category="", rng=None):
+        return self.generate_command(cmd_category, rng).to_dict()
+
+    def generate_command(self, cmd_category="", rng=None, command=None):
+        # Draws exactly like render_command, but keeps the indices of the draws instead of the text
+        if rng is None:
+            rng = self.rng
+        if command is None:
+            category, command = self.choose_command(None, cmd_category, rng)
+        elif cmd_category in self.start_cmd_lists:
+            category = cmd_category
         else:
-            warnings.warn("Command type not covered: " + command)
-            return "WARNING"
-        return command_string
+            category = next(category for category, cmd_list in self.start_cmd_lists.items() if command in cmd_list)
+        chain = self.draw_chain(command, cmd_category, rng)
+        template = self.chain_template(chain)
+        decisions = []
+        deferred = []
+        self.derive_tokens(template, decisions, deferred, rng)
+        self.resolve_distinct(decisions, deferred, rng)
+        return Command(self, category, chain, template, tuple(decisions))
 
-    def insert_placeholders(self, ph):
-        ph = ph.replace('{', '').replace('}', '')
-        if len(ph.split('_')) > 1:
-            ph = random.choice(ph.split('_'))
-        if ph == "goVerb":
-            return random.choice(self.verb_dict["go"])
-        elif ph == "takeVerb":
-            return random.choice(self.verb_dict["take"])
-        elif ph == "findVerb":
-            return random.choice(self.verb_dict["find"])
-        elif ph == "meetVerb":
-            return random.choice(self.verb_dict["meet"])
-        elif ph == "countVerb":
-            return random.choice(self.verb_dict["count"])
-        elif ph == "tellVerb":
-            return random.choice(self.verb_dict["tell"])
-        elif ph == "deliverVerb":
-            return random.choice(self.verb_dict["deliver"])
-        elif ph == "talkVerb":
-            return random.choice(self.verb_dict["talk"])
-        elif ph == "answerVerb":
-            return random.choice(self.verb_dict["answer"])
-        elif ph == "followVerb":
-            return random.choice(self.verb_dict["follow"])
-        elif ph == "placeVerb":
-            return random.choice(self.verb_dict["place"])
-        elif ph == "guideVerb":
-            return random.choice(self.verb_dict["guide"])
-        elif ph == "greetVerb":
-            return random.choice(self.verb_dict["greet"])
-        elif ph == "bringVerb":
-            return random.choice(self.verb_dict["bring"])
-
-        elif ph == "toLocPrep":
-            return random.choice(self.prep_dict["toLocPrep"])
-        elif ph == "fromLocPrep":
-            return random.choice(self.prep_dict["fromLocPrep"])
-        elif ph == "inLocPrep":
-            return random.choice(self.prep_dict["inLocPrep"])
-        elif ph == "onLocPrep":
-            return random.choice(self.prep_dict["onLocPrep"])
-        elif ph == "atLocPrep":
-            return random.choice(self.prep_dict["atLocPrep"])
-        elif ph == "deliverPrep":
-            return random.choice(self.prep_dict["deliverPrep"])
-        elif ph == "talkPrep":
-            return random.choice(self.prep_dict["talkPrep"])
-        elif ph == "ofPrsPrep":
-            return random.choice(self.prep_dict["ofPrsPrep"])
-
-        elif ph == "connector":
-            return random.choice(self.connector_list)
-
-        elif ph == "plcmtLoc2":
-            return "plcmtLoc2"
-        elif ph == "plcmtLoc":
-            return random.choice(self.placement_location_names)
-        elif ph == "room2":
-            return "room2"
-        elif ph == "room":
-            return random.choice(self.room_names)
-        elif ph == "loc2":
-            return "loc2"
-        elif ph == "loc":
-            return random.choice(self.location_names)
-        elif ph == "inRoom":
-            return random.choice(self.prep_dict["inLocPrep"]) + " the " + random.choice(self.room_names)
-        elif ph == "atLoc":
-            return random.choice(self.prep_dict["atLocPrep"]) + " the " + random.choice(self.location_names)
-
-        elif ph == "gestPers":
-            return random.choice(self.gesture_person_list)
-        elif ph == "posePers":
-            return random.choice(self.pose_person_list)
-        elif ph == "name":
-            return random.choice(self.person_names)
-        elif ph == "gestPersPlur":
-            return random.choice(self.gesture_person_plural_list)
-        elif ph == "posePersPlur":
-            return random.choice(self.pose_person_plural_list)
-        elif ph == "persInfo":
-            return random.choice(self.person_info_list)
-
-        elif ph == "obj":
-            return random.choice(self.object_names)
-        elif ph == "singCat":
-            return random.choice(self.object_categories_singular)
-        elif ph == "plurCat":
-            return random.choice(self.object_categories_plural)
-        elif ph == "objComp":
-            return random.choice(self.object_comp_list)
-
-        elif ph == "talk":
-            return random.choice(self.talk_list)
-        elif ph == "question":
-            return random.choice(self.question_list)
-
-        elif ph == "colorClothe":
-            return random.choice(self.color_clothe_list)
-        elif ph == "colorClothes":
-            return random.choice(self.color_clothes_list)
-
-        # replace article later
-        elif ph == "art":
-            return "{art}"
+    def draw_chain(self, command, cmd_category="", rng=None):
+        # The followups are drawn before any slot, so that the whole chain renders from one cached template
+        if rng is None:
+            rng = self.rng
+        chain = [command]
+        followup = self.compiled_templates[command][1]
+        while followup is not None:
+            command = self.choose_command(followup, cmd_category, rng)[1]
+            chain.append(command)
+            followup = self.compiled_templates[command][1]
+        return tuple(chain)
+
+    def derive_template(self, tokens, rng=None, bound=()):
+        # Draws exactly like render_template, but returns the indices of the draws
+        if rng is None:
+            rng = self.rng
+        decisions = []
+        deferred = []
+        self.derive_tokens(tokens, decisions, deferred, rng)
+        self.resolve_distinct(decisions, deferred, rng, bound)
+        return tuple(decisions)
+
+    def derive_tokens(self, tokens, decisions, deferred, rng):
+        for token in tokens:
+            if token.__class__ is str or token[0] == ARTICLE:
+                continue
+            if token[0] == CHOICE:
+                alternative = rng.randrange(len(token[1]))
+                decisions.append(alternative)
+                self.derive_tokens(token[1][alternative], decisions, deferred, rng)
+            elif token[0] == DISTINCT:
+                # Drawn once the entities of the whole command are known
+                deferred.append((len(decisions), token))
+                decisions.append(None)
+            else:
+                if token[0] == ENTITY:
+                    deferred.append((len(decisions), token))
+                decisions.append(rng.randrange(len(token[2])))
+
+    def resolve_distinct(self, decisions, deferred, rng, bound=()):
+        for i, token in deferred:
+            if token[0] == DISTINCT:
+                values = [other[2][decisions[j]] for j, other in deferred
+                          if other[3] == token[3] and decisions[j] is not None and decisions[j] >= 0]
+                values += [value for kind, value in bound if kind == token[3]]
+                decisions[i] = self.pick_distinct_index(token[4], values, rng)
+
+    def replay_templates(self, templates, decisions, bindings=None):
+        parts = []
+        articles = []
+        decisions = iter(decisions)
+        for tokens in templates:
+            self.replay_tokens(tokens, decisions, parts, articles, bindings)
+        for i in articles:
+            parts[i] = self.article("".join(parts[i + 1:]))
+        return "".join(parts)
+
+    def replay_tokens(self, tokens, decisions, parts, articles, bindings=None):
+        for token in tokens:
+            if token.__class__ is str:
+                parts.append(token)
+            elif token[0] == ARTICLE:
+                articles.append(len(parts))
+                parts.append("")
+            elif token[0] == CHOICE:
+                self.replay_tokens(token[1][next(decisions)], decisions, parts, articles, bindings)
+            else:
+                i = next(decisions)
+                value = token[2][i] if i >= 0 else "WARNING"
+                parts.append(value)
+                if bindings is not None:
+                    bindings.append((token[1], value))
+
+    def render_command(self, command, cmd_category="", rng=None):
+        if rng is None:
+            rng = self.rng
+        parts = []
+        deferred = []
+        self.render_tokens(self.chain_template(self.draw_chain(command, cmd_category, rng)), parts, deferred, rng)
+        if deferred:
+            self.resolve_deferred(parts, deferred, rng)
+        return "".join(parts)
+
+    def render_tokens(self, tokens, parts, deferred, rng):
+        for token in tokens:
+            if token.__class__ is str:
+                parts.append(token)
+            elif token[0] == SLOT or token[0] == ENTITY:
+                value = rng.choice(token[2])
+                if token[0] == ENTITY:
+                    # Remembered so that distinct entities can be drawn from the remaining ones
+                    deferred.append((len(parts), token))
+                parts.append(value)
+            elif token[0] == CHOICE:
+                self.render_tokens(rng.choice(token[1]), parts, deferred, rng)
+            else:
+                # Articles and distinct entities depend on the rest of the command, fill them in afterwards
+                deferred.append((len(parts), token))
+                parts.append("")
+
+    def render_template(self, tokens, rng=None, bound=()):
+        if rng is None:
+            rng = self.rng
+        parts = []
+        deferred = []
+        self.render_tokens(tokens, parts, deferred, rng)
+        if deferred:
+            self.resolve_deferred(parts, deferred, rng, bound)
+        return "".join(parts)
+
+    def resolve_deferred(self, parts, deferred, rng, bound=()):
+        # bound holds (kind, value) pairs of entities outside of the rendered tokens that distinct ones avoid too
+        for i, token in deferred:
+            if token[0] == DISTINCT:
+                values = [parts[j] for j, other in deferred if other[0] >= DISTINCT and other[3] == token[3]]
+                values += [value for kind, value in bound if kind == token[3]]
+                parts[i] = self.pick_distinct(token[4], values, rng)
+        for i, token in deferred:
+            if token[0] == ARTICLE:
+                parts[i] = self.article("".join(parts[i + 1:]))
+
+    def pick_distinct(self, base, bound, rng):
+        choice = self.pick_distinct_index(base, bound, rng)
+        return "WARNING" if choice < 0 else self.placeholder_dict[base][choice]
+
+    def excluded_indexes(self, base, bound):
+        index = self.entity_indexes[base]
+        return sorted({i for value in bound for i in index.get(value, ())})
+
+    def pick_distinct_index(self, base, bound, rng):
+        vocab = self.placeholder_dict[base]
+        excluded = self.excluded_indexes(base, bound)
+        if len(excluded) >= len(vocab):
+            warnings.warn("No distinct " + base + " left to choose")
+            return -1
+        # Draw among the remaining positions and step over the excluded ones below the draw
+        choice = rng.randrange(len(vocab) - len(excluded))
+        for i in excluded:
+            if choice < i:
+                break
+            choice += 1
+        return choice
+
+    def article(self, following):
+        return "an" if following.lstrip()[:1].lower() in ["a", "e", "i", "o", "u"] else "a"
+
+    def command_space(self, cmd_lists, cmd_category=""):
+        # Every command that choose_command can pick from, without duplicates
+        return list(dict.fromkeys(command for _, command, _ in self.command_distribution(cmd_lists, cmd_category)))
+
+    def iter_shapes(self, command, cmd_category=""):
+        # Yields the token sequences of every followup chain and choice of alternatives starting with command
+        tokens, followup = self.compiled_templates[command]
+        for _, head, _ in self.weighted_choices(tokens):
+            if followup is None:
+                yield head
+                continue
+            for next_command in self.command_space(self.followup_cmd_lists[followup], cmd_category):
+                for tail in self.iter_shapes(next_command, cmd_category):
+                    yield head + tail
+
+    def weighted_choices(self, tokens):
+        # Every way to pick the alternatives in tokens as (alternatives taken, tokens, probability)
+        heads = [((), (), 1.0)]
+        for token in tokens:
+            if token.__class__ is not str and token[0] == CHOICE:
+                heads = [(choices + (n,) + option_choices, head + option, p * q / len(token[1]))
+                         for choices, head, p in heads
+                         for n, alternative in enumerate(token[1])
+                         for option_choices, option, q in self.weighted_choices(alternative)]
+            else:
+                heads = [(choices, head + (token,), p) for choices, head, p in heads]
+        return heads
+
+    def command_distribution(self, cmd_lists, cmd_category=""):
+        # (category, command, probability) of every command choose_command can pick, the weights only apply here
+        if cmd_category in cmd_lists:
+            categories = [(cmd_category, 1.0)]
+        elif len(cmd_lists) == 1:
+            categories = [(next(iter(cmd_lists)), 1.0)]
+        elif self.category_weights is None:
+            categories = [("people", 0.5), ("objects", 0.5)]
         else:
-            warnings.warn("Placeholder not covered: " + ph)
-            return "WARNING"
+            weights = [self.category_weights.get(category, 1.0) for category in ["people", "objects"]]
+            categories = [(category, weight / sum(weights)) for category, weight in zip(["people", "objects"], weights)]
+        distribution = {}
+        for category, p in categories:
+            if self.command_weights is None:
+                weights = collections.Counter(cmd_lists[category])
+            else:
+                # Weighted lists count every command once
+                weights = {command: self.command_weights.get(command, 1.0) for command in cmd_lists[category]}
+            total = sum(weights.values())
+            for command, weight in weights.items():
+                if p * weight > 0:
+                    distribution[(category, command)] = distribution.get((category, command), 0.0) + \
+                        p * weight / total
+        return [(category, command, p) for (category, command), p in distribution.items()]
+
+    def shape_distribution(self, cmd_category=""):
+        # Token sequences of every followup chain and choice of alternatives with the probability to generate them
+        shapes = {}
+        for _, command, p in self.command_distribution(self.start_cmd_lists, cmd_category):
+            for key, tokens, q in self.weighted_shapes(command, cmd_category):
+                probability = shapes[key][1] if key in shapes else 0.0
+                shapes[key] = (tokens, probability + p * q)
+        return list(shapes.values())
+
+    def weighted_shapes(self, command, cmd_category=""):
+        tokens, followup = self.compiled_templates[command]
+        for choices, head, p in self.weighted_choices(tokens):
+            key = (command,) + choices
+            if followup is None:
+                yield key, head, p
+                continue
+            for _, next_command, q in self.command_distribution(self.followup_cmd_lists[followup], cmd_category):
+                for tail_key, tail, r in self.weighted_shapes(next_command, cmd_category):
+                    yield key + tail_key, head + tail, p * q * r
+
+    def iter_all_commands(self, cmd_category="", seen=None):
+        # Yields every derivation once, the texts of derivations only repeat when alternatives of a choice share
+        # values, for instance a room named like a location. Pass a SeenSet as seen to skip repeated texts
+        if seen is None:
+            self.warn_overlapping_choices()
+        for command in self.command_space(self.start_cmd_lists, cmd_category):
+            for shape in self.iter_shapes(command, cmd_category):
+                for text in self.expand_shape(shape):
+                    if seen is None or seen.add(text.encode()):
+                        yield text
+
+    def overlapping_choices(self):
+        # Names of the choices whose alternatives can render the same text
+        overlaps = []
+        for tokens, _ in self.compiled_templates.values():
+            for token in tokens:
+                if token.__class__ is str or token[0] != CHOICE:
+                    continue
+                texts = [set(self.expand_shape(tuple(alternative))) for alternative in token[1]]
+                if any(a & b for a, b in itertools.combinations(texts, 2)):
+                    name = "_".join(next(t[1] for t in alternative if t.__class__ is not str)
+                                    for alternative in token[1])
+                    if name not in overlaps:
+                        overlaps.append(name)
+        return overlaps
+
+    def warn_overlapping_choices(self):
+        for name in self.overlapping_choices():
+            warnings.warn("Alternatives of {" + name + "} share values, commands using them are counted and "
+                          "enumerated once per alternative")
+
+    def expand_shape(self, shape):
+        parts = [token if token.__class__ is str else "" for token in shape]
+        slots = [i for i, token in enumerate(shape) if token.__class__ is not str and token[0] != ARTICLE]
+        articles = [i for i, token in enumerate(shape) if token.__class__ is not str and token[0] == ARTICLE]
+        # Distinct entities must differ from every other entity of their kind in the command
+        constraints = [(n, [m for m, j in enumerate(slots) if m != n and shape[j][0] >= DISTINCT
+                            and shape[j][3] == shape[i][3]])
+                       for n, i in enumerate(slots) if shape[i][0] == DISTINCT]
+        vocabs = [list(dict.fromkeys(shape[i][2])) for i in slots]
+        for values in itertools.product(*vocabs):
+            if any(values[n] in [values[m] for m in others] for n, others in constraints):
+                continue
+            for i, value in zip(slots, values):
+                parts[i] = value
+            for i in articles:
+                parts[i] = self.article("".join(parts[i + 1:]))
+            yield "".join(parts)
+
+    def count(self, cmd_category=""):
+        # Number of derivations iter_all_commands yields without a seen set, which is the number of different texts
+        # unless warn_overlapping_choices warns. Splits the values of each kind of entity by the placeholders they
+        # can fill, so that distinct entities are counted exactly even when the vocabularies of a kind overlap
+        membership = collections.defaultdict(set)
+        for base, kind in self.entity_placeholders.items():
+            for value in self.placeholder_dict[base]:
+                membership[(kind, value)].add(base)
+        atom_sizes = collections.Counter((kind, frozenset(bases)) for (kind, _), bases in membership.items())
+        atoms = list(atom_sizes)
+        covers = {base: [a for a, (kind, bases) in enumerate(atoms) if base in bases]
+                  for base in self.entity_placeholders}
+        sizes = [atom_sizes[atom] for atom in atoms]
+        # A state holds how many different values of each atom are bound by entities and by distinct entities
+        states = {(0,) * (2 * len(atoms)): 1}
+        self.warn_overlapping_choices()
+        total = 0
+        for command in self.command_space(self.start_cmd_lists, cmd_category):
+            total += sum(self.count_command(command, cmd_category, states, covers, sizes).values())
+        return total
+
+    def count_command(self, command, cmd_category, states, covers, sizes):
+        tokens, followup = self.compiled_templates[command]
+        states = self.count_tokens(tokens, states, covers, sizes)
+        if followup is None:
+            return states
+        result = collections.Counter()
+        for next_command in self.command_space(self.followup_cmd_lists[followup], cmd_category):
+            result.update(self.count_command(next_command, cmd_category, states, covers, sizes))
+        return result
+
+    def count_tokens(self, tokens, states, covers, sizes):
+        for token in tokens:
+            if token.__class__ is str or token[0] == ARTICLE:
+                continue
+            if token[0] == SLOT:
+                factor = len(set(token[2]))
+                states = {state: ways * factor for state, ways in states.items()}
+            elif token[0] == CHOICE:
+                result = collections.Counter()
+                for option in token[1]:
+                    result.update(self.count_tokens(option, states, covers, sizes))
+                states = result
+            else:
+                result = collections.Counter()
+                for state, ways in states.items():
+                    for a in covers[token[4]]:
+                        bound, distinct = state[2 * a], state[2 * a + 1]
+                        fresh = sizes[a] - bound - distinct
+                        if fresh > 0:
+                            offset = 2 * a + (token[0] == DISTINCT)
+                            result[state[:offset] + (state[offset] + 1,) + state[offset + 1:]] += ways * fresh
+                        if token[0] == ENTITY and bound:
+                            result[state] += ways * bound
+                states = result
+        return states
+
+    def insert_placeholders(self, ph, rng=None):
+        parts = []
+        deferred = []
+        self.render_tokens(self.compile_template(ph), parts, deferred, self.rng if rng is None else rng)
+        # Articles and distinct entities are left for the caller to fill in
+        for i, token in deferred:
+            parts[i] = "{art}" if token[0] == ARTICLE else token[1]
+        return "".join(parts)
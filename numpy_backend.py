@@ -0,0 +1,143 @@
+import warnings
+import numpy as np
+from gpsr_commands import ARTICLE, DISTINCT, ENTITY
+
+
+class CompiledShape:
+
+    def __init__(self, literals, columns, slots, distinct_slots):
+        # literals surround the columns, a column is ("value", slot) or ("article", slot or fixed article)
+        self.literals = literals
+        self.columns = columns
+        # Vocabulary array of every slot in token order
+        self.slots = slots
+        # (slot, size of its vocabulary, mapping arrays of the slots it must differ from)
+        self.distinct_slots = distinct_slots
+
+
+def vocab_arrays(vocab, cache):
+    key = id(vocab)
+    if key not in cache:
+        values = np.empty(len(vocab), dtype=object)
+        values[:] = vocab
+        articles = np.empty(len(vocab), dtype=object)
+        articles[:] = ["an" if value[:1].lower() in ["a", "e", "i", "o", "u"] else "a" for value in vocab]
+        cache[key] = values, articles
+    return cache[key]
+
+
+def exclusion_map(generator, source_vocab, base):
+    # Positions in the vocabulary of base holding each value of source_vocab, padded with an out of range sentinel
+    index = generator.entity_indexes[base]
+    sentinel = len(generator.placeholder_dict[base])
+    positions = [index.get(value, []) for value in source_vocab]
+    width = max([len(p) for p in positions] + [1])
+    mapping = np.full((len(source_vocab), width), sentinel, dtype=np.int64)
+    for i, p in enumerate(positions):
+        mapping[i, :len(p)] = p
+    return mapping
+
+
+def compile_shape(generator, tokens, cache):
+    literals = [""]
+    columns = []
+    slots = []
+    slot_tokens = []
+    pending_articles = []
+    for token in tokens:
+        if token.__class__ is str:
+            if pending_articles and token.strip():
+                # Articles followed by fixed text do not depend on any slot
+                for column in pending_articles:
+                    columns[column] = ("article", generator.article(token))
+                pending_articles = []
+            literals[-1] += token
+        elif token[0] == ARTICLE:
+            pending_articles.append(len(columns))
+            columns.append(None)
+            literals.append("")
+        else:
+            for column in pending_articles:
+                columns[column] = ("article", len(slots))
+            pending_articles = []
+            columns.append(("value", len(slots)))
+            literals.append("")
+            slots.append(vocab_arrays(token[2], cache))
+            slot_tokens.append(token)
+    for column in pending_articles:
+        columns[column] = ("article", "a")
+    distinct_slots = []
+    for j, token in enumerate(slot_tokens):
+        if token[0] != DISTINCT:
+            continue
+        # Same as the python renderer, distinct slots avoid every entity and the distinct slots resolved before them
+        related = [m for m, other in enumerate(slot_tokens) if other[0] >= DISTINCT and other[3] == token[3]
+                   and (other[0] == ENTITY or m < j)]
+        mappings = [(m, exclusion_map(generator, slot_tokens[m][2], token[4])) for m in related]
+        distinct_slots.append((j, len(token[2]), mappings))
+    return CompiledShape(literals, columns, slots, distinct_slots)
+
+
+def compile_shapes(generator, cmd_category=""):
+    if cmd_category not in generator.compiled_shapes:
+        cache = {}
+        distribution = generator.shape_distribution(cmd_category)
+        shapes = [compile_shape(generator, tokens, cache) for tokens, _ in distribution]
+        probabilities = np.array([probability for _, probability in distribution])
+        generator.compiled_shapes[cmd_category] = shapes, probabilities / probabilities.sum()
+    return generator.compiled_shapes[cmd_category]
+
+
+def draw_indices(shape, uniforms):
+    indices = [np.minimum((uniforms[:, j] * len(values)).astype(np.int64), len(values) - 1)
+               for j, (values, _) in enumerate(shape.slots)]
+    exhausted = {}
+    for j, size, mappings in shape.distinct_slots:
+        excluded = np.concatenate([mapping[indices[m]] for m, mapping in mappings], axis=1) if mappings else \
+            np.full((len(uniforms), 1), size, dtype=np.int64)
+        # Drop repeated exclusions so that every excluded position is skipped once
+        excluded.sort(axis=1)
+        excluded[:, 1:][excluded[:, 1:] == excluded[:, :-1]] = size
+        excluded.sort(axis=1)
+        remaining = size - (excluded < size).sum(axis=1)
+        choice = (uniforms[:, j] * np.maximum(remaining, 1)).astype(np.int64)
+        for column in range(excluded.shape[1]):
+            choice += choice >= excluded[:, column]
+        indices[j] = np.minimum(choice, size - 1)
+        if (remaining <= 0).any():
+            warnings.warn("No distinct entity left to choose")
+            exhausted[j] = remaining <= 0
+    return indices, exhausted
+
+
+def render_shape(shape, indices, exhausted):
+    text = shape.literals[0]
+    for (kind, source), literal in zip(shape.columns, shape.literals[1:]):
+        if kind == "value":
+            column = shape.slots[source][0][indices[source]]
+            if source in exhausted:
+                column[exhausted[source]] = "WARNING"
+        elif isinstance(source, int):
+            column = shape.slots[source][1][indices[source]]
+        else:
+            column = source
+        text = text + column + literal
+    return text
+
+
+def generate_batch(generator, n, cmd_category="", seed=None):
+    shapes, probabilities = compile_shapes(generator, cmd_category)
+    rng = np.random.default_rng(seed)
+    # One draw for the shape of every command and one for all of their slots
+    shape_ids = rng.choice(len(shapes), size=n, p=probabilities)
+    uniforms = rng.random((n, max(len(shape.slots) for shape in shapes)))
+    texts = np.empty(n, dtype=object)
+    order = np.argsort(shape_ids, kind="stable")
+    boundaries = np.cumsum(np.bincount(shape_ids, minlength=len(shapes)))
+    start = 0
+    for shape, end in zip(shapes, boundaries):
+        if end > start:
+            rows = order[start:end]
+            texts[rows] = render_shape(shape, *draw_indices(shape, uniforms[rows]))
+        start = end
+    return texts.tolist()
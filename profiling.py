@@ -0,0 +1,192 @@
+import collections
+import functools
+import json
+import marshal
+import time
+from gpsr_commands import CHOICE, ARTICLE
+
+# Methods of the generators that a profile shadows with instrumented versions. Commands are counted by the passes
+# that draw them, rendering the text of a record again is timed apart under "render:" keys
+TOKEN_METHODS = ["render_tokens", "derive_tokens"]
+REPLAY_METHODS = ["replay_tokens"]
+EGPSR_METHODS = ["generate_setup", "generate_misplaced_objects", "generator_person_requests"]
+
+
+def placeholder_name(token):
+    if token[0] == ARTICLE:
+        return "art"
+    if token[0] == CHOICE:
+        # Named like the template placeholder, by the first placeholder of every alternative
+        return "_".join(next((placeholder_name(t) for t in alternative if t.__class__ is not str), "")
+                        for alternative in token[1])
+    return token[1]
+
+
+# Calls and time per command type, followup type and placeholder, and the work of the distinct entity draws
+class GeneratorProfile:
+
+    def __init__(self):
+        # "command:<start type>", "followup:<type>", "placeholder:<name>", "distinct:<base>", "render:<start type>"
+        # or "egpsr:<step>" -> [calls, nanoseconds], commands are timed as whole followup chains and followups as
+        # the commands they are followed by
+        self.timings = collections.defaultdict(lambda: [0, 0])
+        # Base placeholder -> [draws, excluded values stepped over, draws with nothing left to choose]
+        self.distinct = collections.defaultdict(lambda: [0, 0, 0])
+        self.placeholder_keys = {}
+
+    def attach(self, generator):
+        # id of a chain template -> (tokens, keys it is timed as, keys its rendering is timed as, followup key of
+        # every command of the chain, command of every token), the tokens are kept so that ids are never reused
+        template_keys = {}
+        for name in TOKEN_METHODS:
+            setattr(generator, name, self.wrap_tokens(getattr(generator, name), template_keys))
+        for name in REPLAY_METHODS:
+            setattr(generator, name, self.wrap_replay(getattr(generator, name), template_keys))
+        generator.pick_distinct_index = self.wrap_distinct(generator, generator.pick_distinct_index)
+        generator.chain_template = self.wrap_chain_template(generator, generator.chain_template, template_keys)
+
+    def wrap_chain_template(self, generator, method, template_keys):
+        @functools.wraps(method)
+        def wrapper(chain):
+            tokens = method(chain)
+            if id(tokens) not in template_keys:
+                # A chain is timed as its start command type, and the tokens of every followup command as the
+                # followup type the command was reached by
+                span_keys = [None] + ["followup:" + generator.compiled_templates[command][1] for command in chain[:-1]]
+                token_spans = []
+                for span, end in enumerate(generator.merge_chain(chain)[1]):
+                    token_spans += [span] * (end - len(token_spans))
+                template_keys[id(tokens)] = tokens, ["command:" + chain[0]], ["render:" + chain[0]], span_keys, \
+                    token_spans
+            return tokens
+        return wrapper
+
+    def attach_egpsr(self, egpsr_generator):
+        for name in EGPSR_METHODS:
+            setattr(egpsr_generator, name, self.wrap_call(getattr(egpsr_generator, name), "egpsr:" + name))
+
+    def detach(self, generator):
+        for name in TOKEN_METHODS + REPLAY_METHODS + EGPSR_METHODS + ["pick_distinct_index", "chain_template"]:
+            generator.__dict__.pop(name, None)
+
+    def wrap_tokens(self, method, template_keys):
+        timings = self.timings
+        clock = time.perf_counter_ns
+
+        @functools.wraps(method)
+        def wrapper(tokens, *args):
+            keys = template_keys.get(id(tokens))
+            if keys is not None:
+                span_times = [0] * len(keys[3])
+            start = clock()
+            for i, token in enumerate(tokens):
+                if token.__class__ is str:
+                    method((token,), *args)
+                    continue
+                token_start = clock()
+                # Choices recurse into this wrapper, so their time includes the placeholders of the alternative
+                method((token,), *args)
+                elapsed = clock() - token_start
+                timing = timings[self.placeholder_key(token)]
+                timing[0] += 1
+                timing[1] += elapsed
+                if keys is not None:
+                    span_times[keys[4][i]] += elapsed
+            if keys is None:
+                return
+            elapsed = clock() - start
+            for key in keys[1]:
+                timing = timings[key]
+                timing[0] += 1
+                timing[1] += elapsed
+            # Distinct entities are drawn once the whole chain is known, their time is only in "distinct:" keys
+            for key, span_time in zip(keys[3], span_times):
+                if key is not None:
+                    timing = timings[key]
+                    timing[0] += 1
+                    timing[1] += span_time
+        return wrapper
+
+    def wrap_replay(self, method, template_keys):
+        timings = self.timings
+        clock = time.perf_counter_ns
+
+        @functools.wraps(method)
+        def wrapper(tokens, *args):
+            keys = template_keys.get(id(tokens))
+            if keys is None:
+                # Alternatives of choices and templates outside of command chains
+                return method(tokens, *args)
+            start = clock()
+            method(tokens, *args)
+            elapsed = clock() - start
+            for key in keys[2]:
+                timing = timings[key]
+                timing[0] += 1
+                timing[1] += elapsed
+        return wrapper
+
+    def wrap_distinct(self, generator, method):
+        timings = self.timings
+        clock = time.perf_counter_ns
+
+        @functools.wraps(method)
+        def wrapper(base, bound, rng):
+            start = clock()
+            choice = method(base, bound, rng)
+            elapsed = clock() - start
+            distinct = self.distinct[base]
+            distinct[0] += 1
+            distinct[1] += len(generator.excluded_indexes(base, bound))
+            distinct[2] += choice < 0
+            timing = timings["distinct:" + base]
+            timing[0] += 1
+            timing[1] += elapsed
+            return choice
+        return wrapper
+
+    def wrap_call(self, method, key):
+        timings = self.timings
+        clock = time.perf_counter_ns
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timing = timings[key]
+                timing[0] += 1
+                timing[1] += clock() - start
+        return wrapper
+
+    def placeholder_key(self, token):
+        # The token is kept with its key so that its id is never reused by another token
+        cached = self.placeholder_keys.get(id(token))
+        if cached is None:
+            cached = self.placeholder_keys[id(token)] = token, "placeholder:" + placeholder_name(token)
+        return cached[1]
+
+    def reset(self):
+        self.timings.clear()
+        self.distinct.clear()
+
+    def to_dict(self):
+        return {
+            "timings": {key: {"calls": calls, "seconds": ns / 1e9} for key, (calls, ns) in sorted(self.timings.items())},
+            "distinct": {base: {"draws": draws, "excluded": excluded, "exhausted": exhausted}
+                         for base, (draws, excluded, exhausted) in sorted(self.distinct.items())}
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def dump_stats(self, file_path):
+        # Same marshalled layout as cProfile.Profile.dump_stats, so pstats and its viewers can read it,
+        # every time includes the placeholders and steps nested in it
+        stats = {}
+        for key, (calls, ns) in self.timings.items():
+            group, name = key.split(":", 1)
+            stats[(group, 0, name)] = (calls, calls, ns / 1e9, ns / 1e9, {})
+        with open(file_path, 'wb') as file:
+            marshal.dump(stats, file)
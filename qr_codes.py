@@ -0,0 +1,148 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import warnings
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_PATH = "Arial.ttf"
+
+# Settings of the processes of a batch export pool
+worker_settings = None
+worker_qr = None
+
+
+def make_qr(box_size=30, border=4):
+    return qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size, font_path=FONT_PATH):
+    # Fonts are loaded once per process and size
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        warnings.warn("Font " + font_path + " not found, using the default font")
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            # Pillow before 10.1 only has a bitmap default font of a fixed size
+            return ImageFont.load_default()
+
+
+def text_size(draw, text, font):
+    if hasattr(draw, "textbbox"):
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        return right - left, bottom - top
+    return draw.textsize(text, font)
+
+
+def render_qr_code(qr, command, font_path=FONT_PATH, font_size=30):
+    # The QR code object is reused, only its data is replaced. clear() keeps the version best_fit chose for the
+    # previous command, start again from the smallest one so the size only depends on this command
+    qr.clear()
+    qr.version = 1
+    qr.add_data(command)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    # Create a drawing object
+    draw = ImageDraw.Draw(img)
+
+    # Calculate text size and position, use half the font size if the command does not fit
+    font = load_font(font_size, font_path)
+    size = text_size(draw, command, font)
+    if size[0] > img.size[0]:
+        font = load_font(font_size // 2, font_path)
+        size = text_size(draw, command, font)
+    text_position = ((img.size[0] - size[0]) // 2, img.size[1] - size[1] - 10)
+
+    # Draw text on the image
+    draw.text(text_position, command, font=font, fill="black")
+    return img
+
+
+def render_sheet(qr, commands, columns=1, font_path=FONT_PATH, font_size=30):
+    images = [render_qr_code(qr, command, font_path, font_size).convert("L") for command in commands]
+    if len(images) == 1:
+        return images[0]
+    cell_width = max(image.size[0] for image in images)
+    cell_height = max(image.size[1] for image in images)
+    rows = (len(images) + columns - 1) // columns
+    sheet = Image.new("L", (columns * cell_width, rows * cell_height), "white")
+    for i, image in enumerate(images):
+        sheet.paste(image, ((i % columns) * cell_width, (i // columns) * cell_height))
+    return sheet
+
+
+def show_qr_codes(commands, box_size=30):
+    qr = make_qr(box_size)
+    for command in commands:
+        render_qr_code(qr, command).show()
+
+
+def read_commands(file_path):
+    # Plain text with one command per line, or the JSONL stream of generator.py
+    commands = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("{"):
+                line = json.loads(line)["text"]
+            if line:
+                commands.append(line[0].upper() + line[1:])
+    return commands
+
+
+def init_worker(settings):
+    global worker_settings, worker_qr
+    worker_settings = settings
+    worker_qr = make_qr(settings["box_size"], settings["border"])
+
+
+def export_sheet(index, commands):
+    settings = worker_settings
+    sheet = render_sheet(worker_qr, commands, settings["columns"], settings["font_path"], settings["font_size"])
+    file_path = os.path.join(settings["output_dir"], "sheet_%05d.%s" % (index, settings["image_format"]))
+    sheet.save(file_path)
+    return file_path
+
+
+def export_qr_sheets(commands, output_dir, image_format="png", columns=1, rows=1, box_size=30, border=4,
+                     font_path=FONT_PATH, font_size=30, workers=None):
+    os.makedirs(output_dir, exist_ok=True)
+    settings = {"output_dir": output_dir, "image_format": image_format, "columns": columns, "box_size": box_size,
+                "border": border, "font_path": font_path, "font_size": font_size}
+    per_sheet = columns * rows
+    tasks = [(i // per_sheet, commands[i:i + per_sheet]) for i in range(0, len(commands), per_sheet)]
+    if workers == 1:
+        init_worker(settings)
+        return [export_sheet(*task) for task in tasks]
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(settings,)) as pool:
+        return pool.starmap(export_sheet, tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a file of commands to QR code sheets")
+    parser.add_argument("commands", help="text file with one command per line or JSONL output of generator.py")
+    parser.add_argument("--output", default="qr_codes", help="directory the sheets are written to")
+    parser.add_argument("--format", choices=["png", "pdf"], default="png", help="file format of the sheets")
+    parser.add_argument("--columns", type=int, default=1, help="QR codes per row of a sheet")
+    parser.add_argument("--rows", type=int, default=1, help="rows of QR codes per sheet")
+    parser.add_argument("--box-size", type=int, default=30, help="pixels per QR code module")
+    parser.add_argument("--border", type=int, default=4, help="modules of white border around a QR code")
+    parser.add_argument("--font", default=FONT_PATH, help="TrueType font for the command text")
+    parser.add_argument("--font-size", type=int, default=30, help="font size, halved for commands that do not fit")
+    parser.add_argument("--workers", type=int, help="number of rendering processes, all cores by default")
+    args = parser.parse_args()
+
+    sheets = export_qr_sheets(read_commands(args.commands), args.output, args.format, args.columns, args.rows,
+                              args.box_size, args.border, args.font, args.font_size, args.workers)
+    print("Wrote %d sheets to %s" % (len(sheets), args.output))
@@ -0,0 +1,124 @@
+import array
+import hashlib
+import math
+import warnings
+
+
+def command_key(record):
+    # The bindings name the chosen alternatives and values, together with the command chain they fix the text
+    fields = [record["type"]] + record["followups"] + [ph + "=" + value for ph, value in record["bindings"]]
+    return "\x1f".join(fields).encode()
+
+
+def fingerprint(key):
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+# Set of 64 bit hash fingerprints of commands in an open addressing table of 8 bytes per slot. Two different
+# commands sharing a fingerprint are taken for the same one, stats() reports the chance of that as collision_rate
+class SeenSet:
+
+    max_load = 0.7
+
+    def __init__(self, max_bytes=1 << 30, initial_slots=1 << 16):
+        self.max_bytes = max_bytes
+        self.slots = array.array('Q', bytes(8 * initial_slots))
+        self.mask = initial_slots - 1
+        self.added = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self.added
+
+    def add(self, key):
+        fp = fingerprint(key)[0] or 1
+        if self.added + 1 > self.max_load * len(self.slots):
+            self.grow()
+        slots = self.slots
+        i = fp & self.mask
+        while slots[i]:
+            if slots[i] == fp:
+                self.rejected += 1
+                return False
+            i = (i + 1) & self.mask
+        slots[i] = fp
+        self.added += 1
+        return True
+
+    def grow(self):
+        if 16 * len(self.slots) > self.max_bytes:
+            raise MemoryError("Seen set would exceed %d bytes, use a BloomFilter for runs this large" % self.max_bytes)
+        old_slots = self.slots
+        self.slots = array.array('Q', bytes(16 * len(old_slots)))
+        self.mask = len(self.slots) - 1
+        for fp in old_slots:
+            if fp:
+                i = fp & self.mask
+                while self.slots[i]:
+                    i = (i + 1) & self.mask
+                self.slots[i] = fp
+
+    def stats(self):
+        attempts = self.added + self.rejected
+        return {
+            "added": self.added,
+            "rejected": self.rejected,
+            "rejection_rate": self.rejected / attempts if attempts else 0.0,
+            # Chance that two different commands in the set share a fingerprint
+            "collision_rate": -math.expm1(-self.added * (self.added - 1) / 2 ** 65),
+            "bytes": len(self.slots) * self.slots.itemsize
+        }
+
+
+# Approximate seen set for very large runs, a new command is wrongly rejected with a small probability
+class BloomFilter:
+
+    def __init__(self, capacity=10 ** 7, error_rate=1e-4, max_bytes=None):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            bits = min(bits, 8 * max_bytes)
+        self.bits = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.array = bytearray((bits + 7) // 8)
+        self.added = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self.added
+
+    def add(self, key):
+        h1, h2 = fingerprint(key)
+        positions = [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+        if all(self.array[p >> 3] & (1 << (p & 7)) for p in positions):
+            self.rejected += 1
+            return False
+        for p in positions:
+            self.array[p >> 3] |= 1 << (p & 7)
+        self.added += 1
+        return True
+
+    def stats(self):
+        attempts = self.added + self.rejected
+        return {
+            "added": self.added,
+            "rejected": self.rejected,
+            "rejection_rate": self.rejected / attempts if attempts else 0.0,
+            # Estimated chance that a new command is mistaken for a seen one
+            "collision_rate": (-math.expm1(-self.hashes * self.added / self.bits)) ** self.hashes,
+            "bytes": len(self.array)
+        }
+
+
+def unique_records(records, seen, max_rejections=100000):
+    rejections = 0
+    for record in records:
+        if seen.add(command_key(record)):
+            rejections = 0
+            yield record
+        else:
+            rejections += 1
+            if rejections > max_rejections:
+                warnings.warn("Stopped after %d duplicate commands in a row, the command space is probably exhausted"
+                              % max_rejections)
+                return
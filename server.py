@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+from gpsr_commands import CommandGenerator
+from egpsr_commands import EgpsrCommandGenerator
+from world_model import load_world_model, WorldWatcher
+
+
+# Serves commands from a warm generator, one JSON request per line and one JSON response line per request
+class GenerationServer:
+
+    # op -> method answering it
+    handlers = {
+        "command": "handle_command",
+        "batch": "handle_batch",
+        "setup": "handle_setup",
+        "setups": "handle_setups",
+        "count": "handle_count",
+        "replay": "handle_replay"
+    }
+
+    def __init__(self, generator, egpsr_generator, max_batch=100000, watcher=None, watch_interval=1.0,
+                 inline_limit=25):
+        self.generator = generator
+        self.egpsr_generator = egpsr_generator
+        self.max_batch = max_batch
+        # Requests for more items than this are answered in a thread, so they do not hold up the event loop
+        self.inline_limit = inline_limit
+        # Optional WorldWatcher whose changes are applied to the generators while serving
+        self.watcher = watcher
+        self.watch_interval = watch_interval
+
+    def request_rng(self, request):
+        # Seeded requests are reproducible whatever the other clients ask for in between
+        return self.generator.rng if request.get("seed") is None else random.Random(request["seed"])
+
+    def batch_size(self, request):
+        n = int(request.get("n", 1))
+        if not 0 <= n <= self.max_batch:
+            raise ValueError("n must be between 0 and %d" % self.max_batch)
+        return n
+
+    def request_category(self, request):
+        category = request.get("category", "")
+        if category not in [""] + list(self.generator.start_cmd_lists):
+            raise ValueError("unknown category, expected one of people, objects or an empty string")
+        return category
+
+    def fork(self, request):
+        # Copy of the server drawing from a generator of its own, to answer the request in another thread
+        forked = copy.copy(self)
+        seed = request.get("seed")
+        forked.generator = self.generator.fork(self.generator.rng.getrandbits(64) if seed is None else seed)
+        forked.egpsr_generator = EgpsrCommandGenerator(forked.generator)
+        return forked
+
+    def handle_command(self, request):
+        return self.generator.generate_record(self.request_category(request), self.request_rng(request))
+
+    def handle_batch(self, request):
+        n = self.batch_size(request)
+        category = self.request_category(request)
+        if request.get("records", False):
+            rng = self.request_rng(request)
+            return [self.generator.generate_record(category, rng) for _ in range(n)]
+        return self.generator.generate_batch(n, category, request.get("seed"), request.get("backend", "python"))
+
+    def handle_setup(self, request):
+        return self.egpsr_generator.generate_setup_record(self.request_rng(request))
+
+    def handle_setups(self, request):
+        rng = self.request_rng(request)
+        return [self.egpsr_generator.generate_setup_record(rng) for _ in range(self.batch_size(request))]
+
+    def handle_replay(self, request):
+        # Command of an addressable stream, the same as generator.py --addressable --seed SEED writes at INDEX
+        return self.generator.replay_record(request["seed"], int(request["index"]), self.request_category(request),
+                                            addressable=True)
+
+    def handle_count(self, request):
+        return self.generator.count(self.request_category(request))
+
+    async def respond(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or request.get("op") not in self.handlers:
+                raise ValueError("unknown op, expected one of " + ", ".join(self.handlers))
+            method = self.handlers[request["op"]]
+            if request["op"] == "count" or request["op"] in ["batch", "setups"] and \
+                    self.batch_size(request) > self.inline_limit:
+                # Threads share the interpreter, so other clients may still wait up to sys.getswitchinterval()
+                # for an answer while a large batch or a count runs, but no longer for all of it
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, getattr(self.fork(request), method), request)
+            else:
+                result = getattr(self, method)(request)
+            return {"ok": True, "result": result}
+        except KeyError as error:
+            return {"ok": False, "error": "missing field " + str(error)}
+        except (ValueError, TypeError) as error:
+            return {"ok": False, "error": str(error)}
+        except Exception as error:
+            # A failed request never drops the connection of the client
+            return {"ok": False, "error": "%s: %s" % (error.__class__.__name__, error)}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(json.dumps(await self.respond(line)).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            # Changed files are parsed in a thread, requests are answered from the previous world meanwhile
+            world_model = await loop.run_in_executor(None, self.watcher.poll)
+            if world_model is not None:
+                self.generator.update_world(*world_model.generator_args())
+                self.egpsr_generator.compile_templates()
+
+    async def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        if self.watcher is not None:
+            # Kept on the server, the event loop only holds weak references to its tasks
+            self.watch_task = asyncio.ensure_future(self.watch())
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self.handle_client, socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve GPSR commands and EGPSR setups from a warm generator")
+    parser.add_argument("--socket", help="Unix socket to listen on instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--seed", type=int, help="seed of the shared stream used by requests without a seed")
+    parser.add_argument("--max-batch", type=int, default=100000, help="largest batch a single request may ask for")
+    parser.add_argument("--inline-limit", type=int, default=25,
+                        help="larger batches and setups are generated in a thread instead of on the event loop")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="check the world files for changes this often and reload the changed ones")
+    parser.add_argument("--world-cache", default=".world_model.cache",
+                        help="file caching the parsed world model, empty to always parse the markdown files")
+    args = parser.parse_args()
+
+    world_file_paths = ['../names/names.md', '../maps/location_names.md', '../maps/room_names.md',
+                        '../objects/objects.md']
+    world_model = load_world_model(*world_file_paths, cache_path=args.world_cache or None)
+    watcher = WorldWatcher(*world_file_paths, world_model=world_model) if args.watch else None
+    generator = CommandGenerator(*world_model.generator_args(), rng=random.Random(args.seed))
+    server = GenerationServer(generator, EgpsrCommandGenerator(generator), args.max_batch, watcher,
+                              args.watch or 1.0, args.inline_limit)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,101 @@
+import random
+import warnings
+
+import pytest
+
+from gpsr_commands import CommandGenerator
+from egpsr_commands import EgpsrCommandGenerator
+from seen_commands import SeenSet
+import corpus
+from worlds import world
+
+CATEGORIES = ["", "people", "objects"]
+
+
+@pytest.fixture
+def generator():
+    return CommandGenerator(*world(), rng=random.Random(0))
+
+
+@pytest.mark.parametrize("addressable", [False, True])
+def test_parallel_output_does_not_depend_on_workers(generator, addressable):
+    runs = [list(generator.iter_parallel(50, seed=3, workers=workers, chunk_size=7, addressable=addressable))
+            for workers in [1, 2, 3]]
+    assert runs[0] == runs[1] == runs[2]
+    assert generator.generate_parallel(50, seed=3, workers=2, chunk_size=7, addressable=addressable) == \
+        [record["text"] for record in runs[0]]
+    for index in [0, 6, 7, 49]:
+        replayed = generator.replay_record(3, index, addressable=addressable, chunk_size=7)
+        assert replayed == runs[0][index]
+
+
+def test_chunked_and_addressable_streams_differ(generator):
+    chunked = list(generator.iter_parallel(40, seed=3, workers=1, chunk_size=10))
+    addressable = list(generator.iter_parallel(40, seed=3, workers=1, chunk_size=10, addressable=True))
+    # The first command of a chunk used to be the addressable command of the same index
+    assert all(chunked[i]["text"] != addressable[i]["text"] for i in range(0, 40, 10))
+
+
+@pytest.mark.parametrize("category", CATEGORIES)
+def test_count_matches_enumeration(generator, category):
+    with warnings.catch_warnings():
+        # Alternatives sharing values would make texts repeat
+        warnings.simplefilter("error")
+        texts = list(generator.iter_all_commands(category))
+        assert generator.count(category) == len(texts) == len(set(texts))
+
+
+def test_overlapping_alternatives_are_warned_and_deduplicated():
+    names, locations, placement_locations, rooms, objects, plural, singular = world()
+    generator = CommandGenerator(names, locations, placement_locations, [locations[1]] + rooms, objects, plural,
+                                 singular)
+    with pytest.warns(UserWarning, match="share values"):
+        texts = list(generator.iter_all_commands("people"))
+    with pytest.warns(UserWarning, match="share values"):
+        assert generator.count("people") == len(texts)
+    assert sorted(generator.iter_all_commands("people", SeenSet())) == sorted(set(texts))
+
+
+@pytest.mark.parametrize("category", CATEGORIES)
+def test_generate_command_draws_like_render_command(generator, category):
+    for seed in range(200):
+        rng = random.Random(seed)
+        command = generator.generate_command(category, rng)
+        render_rng = random.Random(seed)
+        text = generator.render_command(generator.choose_command(None, category, render_rng)[1], category, render_rng)
+        assert command.text == text
+        assert rng.getstate() == render_rng.getstate()
+
+
+@pytest.mark.parametrize("category", CATEGORIES)
+def test_batch_texts_are_the_commands_of_the_seed(generator, category):
+    texts = [command.text for command in generator.generate_commands(300, category, seed=4)]
+    assert generator.generate_batch(300, category, seed=4) == texts
+    generator.set_weights({"goToLoc": 5, "findObj": 0.5}, {"people": 1, "objects": 3})
+    texts = [command.text for command in generator.generate_commands(300, category, seed=4)]
+    assert generator.generate_batch(300, category, seed=4) == texts
+
+
+def test_setup_record_matches_setup():
+    for seed in range(50):
+        egpsr_generator = EgpsrCommandGenerator(CommandGenerator(*world(4), rng=random.Random(seed)))
+        text = egpsr_generator.generate_setup()
+        assert egpsr_generator.generate_setup_record(random.Random(seed))["text"] == text
+
+
+def test_corpus_round_trip_matches_records(generator, tmp_path):
+    path = str(tmp_path / "commands.corpus")
+    with corpus.CorpusWriter(path, generator) as writer:
+        for rows in generator.iter_parallel(60, seed=5, workers=2, chunk_size=16, output="corpus"):
+            writer.write_rows(rows)
+    records = list(generator.iter_parallel(60, seed=5, workers=1, chunk_size=16))
+    with corpus.CorpusReader(path) as reader:
+        assert [command.to_dict() for command in reader] == records
+        # Views may outlive the reader
+        rows = reader.slice(10, 20)
+    assert len(rows) == 10 * reader.width
+
+
+def test_weights_leaving_no_command_are_rejected():
+    with pytest.raises(ValueError, match="foundObj"):
+        CommandGenerator(*world(), command_weights={"takeObj": 0})
@@ -0,0 +1,49 @@
+import collections
+import random
+
+import pytest
+
+from gpsr_commands import CommandGenerator
+from worlds import world
+
+pytest.importorskip("numpy")
+
+CATEGORIES = ["", "people", "objects"]
+WEIGHTS = [(None, None), ({"goToLoc": 4, "findObj": 0.25, "talkInfo": 3}, {"people": 1, "objects": 3})]
+
+
+def feature(text):
+    # Verb, first word after it and length tell most templates and alternatives apart
+    words = text.split()
+    return words[0], words[1], len(words)
+
+
+def total_variation(texts, other_texts):
+    counts, other_counts = collections.Counter(map(feature, texts)), collections.Counter(map(feature, other_texts))
+    return sum(abs(counts[key] / len(texts) - other_counts[key] / len(other_texts))
+               for key in set(counts) | set(other_counts)) / 2
+
+
+@pytest.mark.parametrize("category", CATEGORIES)
+def test_numpy_commands_are_in_the_command_space(category):
+    generator = CommandGenerator(*world(), rng=random.Random(0))
+    texts = generator.generate_batch(5000, category, seed=1, backend="numpy")
+    assert len(texts) == 5000
+    assert set(texts) <= set(generator.iter_all_commands(category))
+
+
+@pytest.mark.parametrize("category", CATEGORIES)
+@pytest.mark.parametrize("command_weights, category_weights", WEIGHTS)
+def test_numpy_distribution_matches_python(category, command_weights, category_weights):
+    generator = CommandGenerator(*world(), rng=random.Random(0), command_weights=command_weights,
+                                 category_weights=category_weights)
+    python_texts = generator.generate_batch(20000, category, seed=1)
+    numpy_texts = generator.generate_batch(20000, category, seed=1, backend="numpy")
+    # Two python runs of other seeds differ by about 0.04 on this world
+    assert total_variation(python_texts, numpy_texts) < 0.08
+
+
+def test_numpy_batches_are_reproducible():
+    generator = CommandGenerator(*world(), rng=random.Random(0))
+    assert generator.generate_batch(100, seed=3, backend="numpy") == generator.generate_batch(100, seed=3,
+                                                                                              backend="numpy")
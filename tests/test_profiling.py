@@ -0,0 +1,59 @@
+import collections
+import random
+
+from gpsr_commands import CommandGenerator
+from egpsr_commands import EgpsrCommandGenerator
+from worlds import world
+
+
+def command_calls(profile):
+    return sum(calls for key, (calls, _) in profile.timings.items() if key.startswith("command:"))
+
+
+def test_commands_are_counted_once_per_draw():
+    generator = CommandGenerator(*world(4), rng=random.Random(0))
+    profile = generator.enable_profiling()
+    list(generator.iter_commands(50))
+    assert command_calls(profile) == 50
+    assert sum(calls for key, (calls, _) in profile.timings.items() if key.startswith("render:")) == 50
+    profile.reset()
+    for command in generator.generate_commands(50, seed=1):
+        # Rendering the text of a command again is not drawing it again
+        command.text, command.bindings, command.to_dict()
+    assert command_calls(profile) == 50
+    profile.reset()
+    generator.generate_batch(50)
+    assert command_calls(profile) == 50
+
+
+def test_placeholders_are_counted_once_per_binding():
+    generator = CommandGenerator(*world(4), rng=random.Random(0))
+    profile = generator.enable_profiling()
+    records = list(generator.iter_commands(100))
+    bound = collections.Counter(ph for record in records for ph, _ in record["bindings"])
+    for name, count in bound.items():
+        assert profile.timings["placeholder:" + name][0] == count
+
+
+def test_disabled_profiling_restores_plain_methods():
+    generator = CommandGenerator(*world(4), rng=random.Random(0))
+    egpsr_generator = EgpsrCommandGenerator(generator)
+    egpsr_generator.enable_profiling()
+    egpsr_generator.generate_setup()
+    egpsr_generator.disable_profiling()
+    assert not {"render_tokens", "derive_tokens", "replay_tokens", "chain_template"} & set(vars(generator))
+    assert "generate_setup" not in vars(egpsr_generator)
+
+
+def test_followups_are_timed_as_their_own_commands():
+    generator = CommandGenerator(*world(4), rng=random.Random(0))
+    profile = generator.enable_profiling()
+    records = list(generator.iter_commands(200, "objects"))
+    reached = collections.Counter(generator.compiled_templates[command][1] for record in records
+                                  for command in ([record["type"]] + record["followups"])[:-1])
+    for followup, count in reached.items():
+        assert profile.timings["followup:" + followup][0] == count
+    # Followups are parts of the commands, their times add up to less than the whole commands
+    followup_time = sum(ns for key, (_, ns) in profile.timings.items() if key.startswith("followup:"))
+    command_time = sum(ns for key, (_, ns) in profile.timings.items() if key.startswith("command:"))
+    assert followup_time < command_time
@@ -0,0 +1,53 @@
+import math
+
+import pytest
+
+from seen_commands import SeenSet, BloomFilter, command_key, unique_records
+
+
+def keys(n, prefix="command"):
+    return [("%s %d" % (prefix, i)).encode() for i in range(n)]
+
+
+def test_seen_set_grows_and_keeps_every_key():
+    seen = SeenSet(initial_slots=16)
+    assert all(seen.add(key) for key in keys(1000))
+    assert len(seen.slots) >= 1000 / SeenSet.max_load
+    assert not any(seen.add(key) for key in keys(1000))
+    stats = seen.stats()
+    assert (stats["added"], stats["rejected"], stats["rejection_rate"]) == (1000, 1000, 0.5)
+    assert stats["bytes"] == 8 * len(seen.slots)
+    assert 0 < stats["collision_rate"] < 1e-12
+
+
+def test_seen_set_refuses_to_grow_past_its_memory_limit():
+    seen = SeenSet(max_bytes=8 * 64, initial_slots=16)
+    with pytest.raises(MemoryError):
+        for key in keys(1000):
+            seen.add(key)
+
+
+def test_bloom_filter_is_sized_for_its_capacity_and_error_rate():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    assert bloom.bits == math.ceil(10000 * math.log(100) / math.log(2) ** 2)
+    assert bloom.hashes == 7
+    assert len(bloom.array) == (bloom.bits + 7) // 8
+    assert BloomFilter(capacity=10000, error_rate=0.01, max_bytes=100).bits == 800
+
+
+def test_bloom_filter_false_positives_stay_near_the_error_rate():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    # Some of the keys are already false positives while the filter fills up
+    assert sum(bloom.add(key) for key in keys(10000)) > (1 - 0.01) * 10000
+    assert not any(bloom.add(key) for key in keys(10000))
+    # Probing adds the keys too, a few of them keep the filter close to its capacity
+    false_positives = sum(not bloom.add(key) for key in keys(1000, "other"))
+    assert false_positives < 3 * 0.01 * 1000
+    assert bloom.stats()["collision_rate"] < 0.02
+
+
+def test_unique_records_stop_once_the_space_is_exhausted():
+    records = [{"type": "goToLoc", "followups": [], "bindings": [["loc", "hall"]], "text": "go to the hall"}] * 10
+    with pytest.warns(UserWarning, match="exhausted"):
+        assert list(unique_records(iter(records), SeenSet(), max_rejections=3)) == records[:1]
+    assert command_key(records[0]) != command_key(dict(records[0], bindings=[["loc", "bed"]]))
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from gpsr_commands import CommandGenerator
+from egpsr_commands import EgpsrCommandGenerator
+from server import GenerationServer
+from worlds import world
+
+
+@pytest.fixture
+def server():
+    generator = CommandGenerator(*world(4), rng=random.Random(0))
+    return GenerationServer(generator, EgpsrCommandGenerator(generator), max_batch=1000, inline_limit=25)
+
+
+def respond(server, request):
+    return asyncio.run(server.respond(json.dumps(request) if isinstance(request, dict) else request))
+
+
+@pytest.mark.parametrize("request_line, error", [
+    ("not json", "Expecting value"),
+    ("[1]", "unknown op"),
+    ({"op": "dance"}, "unknown op"),
+    ({"op": "batch", "n": 1001}, "n must be between 0 and 1000"),
+    ({"op": "batch", "n": 2, "backend": "gpu"}, "unknown backend"),
+    ({"op": "command", "category": "animals"}, "unknown category"),
+    ({"op": "replay", "index": 3}, "missing field 'seed'"),
+    ({"op": "replay", "seed": 1, "index": 1e400}, "OverflowError")
+])
+def test_failed_requests_are_answered(server, request_line, error):
+    response = respond(server, request_line)
+    assert not response["ok"]
+    assert error in response["error"]
+
+
+def test_unexpected_errors_are_answered(server, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("broken backend")
+    monkeypatch.setattr(server.generator, "generate_batch", fail)
+    assert respond(server, {"op": "batch", "n": 2}) == {"ok": False, "error": "RuntimeError: broken backend"}
+
+
+@pytest.mark.parametrize("request_fields", [{"op": "batch"}, {"op": "batch", "records": True}, {"op": "setups"}])
+def test_threaded_requests_answer_like_inline_ones(server, request_fields):
+    request = dict(request_fields, n=100, seed=7)
+    threaded = respond(server, request)
+    server.inline_limit = 1000
+    inline = respond(server, request)
+    assert threaded["ok"] and threaded == inline
+    assert len(threaded["result"]) == 100
+
+
+def test_seeded_requests_are_reproducible(server):
+    assert respond(server, {"op": "command", "seed": 2}) == respond(server, {"op": "command", "seed": 2})
+    record = respond(server, {"op": "replay", "seed": 2, "index": 5})["result"]
+    assert record == server.generator.replay_record(2, 5, addressable=True)
+    assert respond(server, {"op": "count", "category": "objects"})["result"] == server.generator.count("objects")
+
+
+def test_connection_survives_failed_requests(server, tmp_path):
+    async def exchange():
+        socket_path = str(tmp_path / "gpsr.sock")
+        serving = asyncio.ensure_future(server.serve(socket_path=socket_path))
+        while not serving.done():
+            try:
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+        responses = []
+        for request in [{"op": "batch", "n": 2, "backend": "gpu"}, {"op": "command"}]:
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        serving.cancel()
+        return responses
+    failed, answered = asyncio.run(exchange())
+    assert not failed["ok"] and answered["ok"]
@@ -0,0 +1,101 @@
+import os
+import warnings
+
+import pytest
+
+import world_model
+from world_model import load_world_model, WorldWatcher
+
+NAMES = "# Names\n\n| Names |\n| :---: |\n| Ann |\n| Bob |\n"
+LOCATIONS = "# Location names\n\n| Location ID | Name |\n| :---: | :---: |\n| 1 | bed (p) |\n| 2 | hall |\n"
+ROOMS = "# Room names\n\n| Room names |\n| :---: |\n| kitchen |\n| bedroom |\n"
+OBJECTS = "# Class Fruits (fruit)\n\n| Objectname |\n| :---: |\n| apple |\n\n" \
+          "# Class Tools (tool)\n\n| Objectname |\n| :---: |\n| hammer |\n"
+
+
+def write_world(directory):
+    paths = []
+    for name, content in [("names", NAMES), ("locations", LOCATIONS), ("rooms", ROOMS), ("objects", OBJECTS)]:
+        paths.append(str(directory / (name + ".md")))
+        with open(paths[-1], "w") as file:
+            file.write(content)
+    return paths
+
+
+def rewrite(path, content):
+    # Another modification time even on file systems with a coarse clock
+    stat = os.stat(path)
+    with open(path, "w") as file:
+        file.write(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def count_parses(monkeypatch):
+    parses = []
+    parse_world_model = world_model.parse_world_model
+    monkeypatch.setattr(world_model, "parse_world_model", lambda *data: parses.append(data) or parse_world_model(*data))
+    return parses
+
+
+def test_cache_is_reused_while_the_files_do_not_change(tmp_path, monkeypatch):
+    paths = write_world(tmp_path)
+    cache_path = str(tmp_path / "world.cache")
+    parses = count_parses(monkeypatch)
+    first = load_world_model(*paths, cache_path=cache_path)
+    second = load_world_model(*paths, cache_path=cache_path)
+    assert len(parses) == 1
+    assert second.fields() == first.fields()
+    assert first.names == ["Ann", "Bob"] and first.placement_location_names == ["bed"]
+
+
+def test_touched_files_with_the_same_contents_are_not_parsed_again(tmp_path, monkeypatch):
+    paths = write_world(tmp_path)
+    cache_path = str(tmp_path / "world.cache")
+    parses = count_parses(monkeypatch)
+    load_world_model(*paths, cache_path=cache_path)
+    rewrite(paths[0], NAMES)
+    load_world_model(*paths, cache_path=cache_path)
+    assert len(parses) == 1
+
+
+def test_changed_files_invalidate_the_cache(tmp_path, monkeypatch):
+    paths = write_world(tmp_path)
+    cache_path = str(tmp_path / "world.cache")
+    parses = count_parses(monkeypatch)
+    load_world_model(*paths, cache_path=cache_path)
+    rewrite(paths[2], ROOMS + "| garage |\n")
+    assert load_world_model(*paths, cache_path=cache_path).room_names == ["kitchen", "bedroom", "garage"]
+    assert len(parses) == 2
+    # The updated cache is used from then on
+    load_world_model(*paths, cache_path=cache_path)
+    assert len(parses) == 2
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    paths = write_world(tmp_path)
+    cache_path = str(tmp_path / "world.cache")
+    with open(cache_path, "wb") as file:
+        file.write(b"not a cache")
+    assert load_world_model(*paths, cache_path=cache_path).names == ["Ann", "Bob"]
+
+
+def test_watcher_only_reports_changes(tmp_path):
+    paths = write_world(tmp_path)
+    watcher = WorldWatcher(*paths)
+    assert watcher.poll() is None
+    rewrite(paths[0], NAMES + "| Cid |\n")
+    assert watcher.poll().names == ["Ann", "Bob", "Cid"]
+    assert watcher.poll() is None
+
+
+@pytest.mark.parametrize("kind", range(4))
+def test_watcher_keeps_previous_entries_of_an_empty_file(tmp_path, kind):
+    paths = write_world(tmp_path)
+    watcher = WorldWatcher(*paths)
+    previous = watcher.world_model.fields()
+    rewrite(paths[kind], "")
+    with warnings.catch_warnings(record=True) as caught:
+        # The parsers warn about the empty file as well
+        warnings.simplefilter("always")
+        assert watcher.poll().fields() == previous
+    assert any("Keeping the previous" in str(warning.message) for warning in caught)
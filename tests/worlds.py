@@ -0,0 +1,8 @@
+def world(size=2):
+    # Small enough to enumerate at the default size, placement locations are a subset of the locations
+    # like in the world files of the competition
+    letters = [chr(ord("a") + i) for i in range(size + 1)]
+    locations = ["location " + letter for letter in letters]
+    return (["Name" + letter.upper() for letter in letters[:size]], locations, locations[::2],
+            ["room " + letter for letter in letters[:size]], ["object " + letter for letter in letters[:size]],
+            ["fruits", "tools"], ["fruit", "tool"])
@@ -0,0 +1,232 @@
+import hashlib
+import marshal
+import os
+import re
+import sys
+import warnings
+
+# Bump when the parsed fields change so that old caches are ignored
+CACHE_VERSION = 1
+
+
+def read_data(file_path):
+    with open(file_path, 'r') as file:
+        data = file.read()
+    return data
+
+
+def parse_names(data):
+    parsed_names = re.findall(r'\|\s*([A-Za-z]+)\s*\|', data, re.DOTALL)
+    parsed_names = [name.strip() for name in parsed_names]
+
+    if parsed_names:
+        return parsed_names[1:]
+    else:
+        warnings.warn("List of names is empty. Check content of names markdown file")
+        return []
+
+
+def parse_locations(data):
+    parsed_locations = re.findall(r'\|\s*([0-9]+)\s*\|\s*([A-Za-z,\s, \(,\)]+)\|', data, re.DOTALL)
+    parsed_locations = [b for (a, b) in parsed_locations]
+    parsed_locations = [location.strip() for location in parsed_locations]
+
+    parsed_placement_locations = [location for location in parsed_locations if location.endswith('(p)')]
+    parsed_locations = [location.replace('(p)', '') for location in parsed_locations]
+    parsed_placement_locations = [location.replace('(p)', '') for location in parsed_placement_locations]
+    parsed_placement_locations = [location.strip() for location in parsed_placement_locations]
+    parsed_locations = [location.strip() for location in parsed_locations]
+
+    if parsed_locations:
+        return parsed_locations, parsed_placement_locations
+    else:
+        warnings.warn("List of locations is empty. Check content of location markdown file")
+        return []
+
+
+def parse_rooms(data):
+    parsed_rooms = re.findall(r'\|\s*(\w+ \w*)\s*\|', data, re.DOTALL)
+    parsed_rooms = [rooms.strip() for rooms in parsed_rooms]
+
+    if parsed_rooms:
+        return parsed_rooms[1:]
+    else:
+        warnings.warn("List of rooms is empty. Check content of room markdown file")
+        return []
+
+
+def parse_objects(data):
+    parsed_objects = re.findall(r'\|\s*(\w+)\s*\|', data, re.DOTALL)
+    parsed_objects = [objects for objects in parsed_objects if objects != 'Objectname']
+    parsed_objects = [objects.replace("_", " ") for objects in parsed_objects]
+    parsed_objects = [objects.strip() for objects in parsed_objects]
+
+    parsed_categories = re.findall(r'# Class \s*([\w,\s, \(,\)]+)\s*', data, re.DOTALL)
+    parsed_categories = [category.strip() for category in parsed_categories]
+    parsed_categories = [category.replace('(', '').replace(')', '').split() for category in parsed_categories]
+    parsed_categories_plural = [category[0] for category in parsed_categories]
+    parsed_categories_plural = [category.replace("_", " ") for category in parsed_categories_plural]
+    parsed_categories_singular = [category[1] for category in parsed_categories]
+    parsed_categories_singular = [category.replace("_", " ") for category in parsed_categories_singular]
+
+    if parsed_objects or parsed_categories:
+        return parsed_objects, parsed_categories_plural, parsed_categories_singular
+    else:
+        warnings.warn("List of objects or object categories is empty. Check content of object markdown file")
+        return []
+
+
+def parse_objects_by_category(data):
+    objects_by_category = {}
+    # Every class heading is followed by the table of its objects
+    for section in re.split(r'(?=# Class )', data):
+        category = re.match(r'# Class \s*([\w,\s, \(,\)]+)\s*', section)
+        if category is None:
+            continue
+        category = category.group(1).strip().replace('(', '').replace(')', '').split()[0].replace("_", " ")
+        objects = re.findall(r'\|\s*(\w+)\s*\|', section, re.DOTALL)
+        objects_by_category[category] = [objects.replace("_", " ").strip() for objects in objects
+                                         if objects != 'Objectname']
+    return objects_by_category
+
+
+class WorldModel:
+
+    def __init__(self, names, location_names, placement_location_names, room_names, object_names,
+                 object_categories_plural, object_categories_singular, objects_by_category):
+        self.names = names
+        self.location_names = location_names
+        self.placement_location_names = placement_location_names
+        self.room_names = room_names
+        self.object_names = object_names
+        self.object_categories_plural = object_categories_plural
+        self.object_categories_singular = object_categories_singular
+        self.objects_by_category = objects_by_category
+
+        self.placement_locations = set(placement_location_names)
+        self.rooms = set(room_names)
+        self.object_category = {obj: category for category, objects in objects_by_category.items()
+                                for obj in objects}
+        self.category_singular = dict(zip(object_categories_plural, object_categories_singular))
+        self.category_plural = dict(zip(object_categories_singular, object_categories_plural))
+
+    def fields(self):
+        return (self.names, self.location_names, self.placement_location_names, self.room_names, self.object_names,
+                self.object_categories_plural, self.object_categories_singular, self.objects_by_category)
+
+    def generator_args(self):
+        return (self.names, self.location_names, self.placement_location_names, self.room_names, self.object_names,
+                self.object_categories_plural, self.object_categories_singular)
+
+
+def parse_world_model(names_data, locations_data, rooms_data, objects_data):
+    location_names, placement_location_names = parse_locations(locations_data)
+    object_names, object_categories_plural, object_categories_singular = parse_objects(objects_data)
+    return WorldModel(parse_names(names_data), location_names, placement_location_names, parse_rooms(rooms_data),
+                      object_names, object_categories_plural, object_categories_singular,
+                      parse_objects_by_category(objects_data))
+
+
+def read_cache(cache_path):
+    try:
+        # Reading the whole file first, marshal.load reads file objects in small pieces and is several times slower
+        with open(cache_path, 'rb') as file:
+            cache = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(cache, dict) or cache.get("version") != (CACHE_VERSION, sys.version_info[:2]):
+        return None
+    return cache
+
+
+def write_cache(cache_path, cache):
+    # Write to a temporary file first so that concurrent processes never read a partial cache
+    temp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(marshal.dumps(cache))
+        os.replace(temp_path, cache_path)
+    except OSError as error:
+        warnings.warn("Could not write world model cache: " + str(error))
+
+
+def load_world_model(names_file_path, locations_file_path, rooms_file_path, objects_file_path, cache_path=None):
+    file_paths = [os.path.abspath(path) for path in
+                  (names_file_path, locations_file_path, rooms_file_path, objects_file_path)]
+    file_stats = [(path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in file_paths]
+    cache = read_cache(cache_path) if cache_path else None
+    # Unchanged modification times skip reading the files, otherwise unchanged contents still skip parsing
+    if cache is not None and cache["stats"] == file_stats:
+        return WorldModel(*cache["fields"])
+    data = []
+    for path in file_paths:
+        with open(path, 'rb') as file:
+            data.append(file.read())
+    digests = [hashlib.sha256(content).hexdigest() for content in data]
+    if cache is not None and cache["digests"] == digests:
+        world_model = WorldModel(*cache["fields"])
+    else:
+        world_model = parse_world_model(*[content.decode() for content in data])
+    if cache_path:
+        write_cache(cache_path, {"version": (CACHE_VERSION, sys.version_info[:2]), "stats": file_stats,
+                                 "digests": digests, "fields": world_model.fields()})
+    return world_model
+
+
+# Parses again only the world files that changed since the last poll
+class WorldWatcher:
+
+    def __init__(self, names_file_path, locations_file_path, rooms_file_path, objects_file_path, world_model=None):
+        self.file_paths = {"names": names_file_path, "locations": locations_file_path, "rooms": rooms_file_path,
+                           "objects": objects_file_path}
+        self.file_stats = {kind: self.file_stat(path) for kind, path in self.file_paths.items()}
+        if world_model is None:
+            world_model = parse_world_model(*[read_data(path) for path in self.file_paths.values()])
+        self.world_model = world_model
+
+    def file_stat(self, file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        # Returns the updated world model, or None when no file changed
+        changed = [kind for kind, path in self.file_paths.items() if self.file_stat(path) != self.file_stats[kind]]
+        if not changed:
+            return None
+        fields = dict(zip(["names", "location_names", "placement_location_names", "room_names", "object_names",
+                           "object_categories_plural", "object_categories_singular", "objects_by_category"],
+                          self.world_model.fields()))
+        for kind in changed:
+            # Stat before reading, so that a write during the read is picked up by the next poll
+            self.file_stats[kind] = self.file_stat(self.file_paths[kind])
+            try:
+                data = read_data(self.file_paths[kind])
+            except OSError as error:
+                warnings.warn("Keeping the previous " + kind + ": " + str(error))
+                continue
+            parsed = self.parse(kind, data)
+            if parsed is None:
+                warnings.warn("Keeping the previous " + kind + ", " + self.file_paths[kind] + " has no entries")
+                continue
+            fields.update(parsed)
+        self.world_model = WorldModel(**fields)
+        return self.world_model
+
+    def parse(self, kind, data):
+        if kind == "names":
+            names = parse_names(data)
+            return {"names": names} if names else None
+        if kind == "locations":
+            locations = parse_locations(data)
+            return {"location_names": locations[0], "placement_location_names": locations[1]} if locations else None
+        if kind == "rooms":
+            rooms = parse_rooms(data)
+            return {"room_names": rooms} if rooms else None
+        objects = parse_objects(data)
+        if not objects:
+            return None
+        return {"object_names": objects[0], "object_categories_plural": objects[1],
+                "object_categories_singular": objects[2], "objects_by_category": parse_objects_by_category(data)}